@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Display backlight through /sys/class/backlight.
+
+	RoboEyes dims the backlight while it sleeps (see RoboEyes.set_power_saving()):
+
+	robo.set_power_saving( ON, sleep_after=60000, backlight=Backlight.find() )
+
+	Writing the brightness usually needs root, or a udev rule giving the group write access
+	to /sys/class/backlight/*/brightness. find() returns None when there is no backlight
+	device or it is not writable, the eyes then sleep with the backlight on.
+"""
+import os
+
+from fbbackend import _read_sysfs
+
+SYSFS_BACKLIGHT = "/sys/class/backlight"
+
+
+def _write_sysfs( path, value ):
+	with open( path, "w" ) as f:
+		f.write( str( value ) )
+
+
+class Backlight:
+	def __init__( self, path, sleep_level=0 ):
+		self.path = path # /sys/class/backlight/<device>
+		self.max_brightness = int( _read_sysfs( os.path.join( path, "max_brightness" ) ) )
+		self.sleep_level = sleep_level # brightness while asleep, fraction of max_brightness (0: off)
+		self._awake_brightness = None # brightness to restore on wake()
+
+	@classmethod
+	def find( cls, name=None, sleep_level=0 ):
+		""" The backlight device called name, or the first one; None when there is none
+		    or it is not writable. """
+		try:
+			names = [ name ] if name else sorted( os.listdir( SYSFS_BACKLIGHT ) )
+		except OSError:
+			return None
+		for name in names:
+			path = os.path.join( SYSFS_BACKLIGHT, name )
+			if not os.access( os.path.join( path, "brightness" ), os.W_OK ):
+				continue
+			try:
+				return cls( path, sleep_level )
+			except (OSError, ValueError):
+				continue
+		return None
+
+	@property
+	def brightness( self ):
+		return int( _read_sysfs( os.path.join( self.path, "brightness" ) ) )
+
+	@brightness.setter
+	def brightness( self, value ):
+		_write_sysfs( os.path.join( self.path, "brightness" ), max( 0, min( int( value ), self.max_brightness ) ) )
+
+	def sleep( self ):
+		""" Dim to sleep_level, remembering the brightness for wake(). """
+		if self._awake_brightness is None:
+			self._awake_brightness = self.brightness
+		self.brightness = round( self.max_brightness * self.sleep_level )
+
+	def wake( self ):
+		""" Restore the brightness from before sleep(). """
+		if self._awake_brightness is not None:
+			self.brightness = self._awake_brightness
+			self._awake_brightness = None
+
+	def __repr__( self ):
+		return "Backlight(%s, max %d)" % ( self.path, self.max_brightness )
@@ -0,0 +1,71 @@
+# Eye atlas hit rate under a real frame clock
+#
+# Plays the animations the atlas is built from (eyeatlas._scripts()) on a RoboEyes using
+# the atlas, and reports how many eyes were found in it:
+#   simulated   frames exactly frameInterval apart, the clock the atlas is built with
+#   jitter      simulated, each frame 0 to N ms late like a loop woken up by sleep()
+#   real        time.perf_counter(), update() and sleep( next_frame_in() ) (--real, ~70 s)
+#
+#    python3 bench_eyeatlas.py [jitter ms] [frame rate] [--real]
+#
+import random
+import sys
+import tempfile
+import time
+
+from roboeyes import *
+from display_fbgen import Framebuffer
+from fbbackend import NullBackend
+from eyeatlas import EyeAtlas, _scripts
+
+args = [ a for a in sys.argv[1:] if not a.startswith( "--" ) ]
+jitter = int( args[0] ) if len( args ) > 0 else 3
+fps = int( args[1] ) if len( args ) > 1 else 15
+real = "--real" in sys.argv
+
+def make_eyes( clock ):
+	fb = Framebuffer( 480, 320, pixel_format="RGB565", backend=NullBackend( 480, 320, 16 ) )
+	return RoboEyes( fb, 480, 320, frame_rate=fps, on_show=lambda robo: None, clock=clock )
+
+def play( directory, clock, advance ):
+	# run every script on fresh eyes, advance( robo ) moving the clock to the next update()
+	hits = misses = frames = 0
+	for script in _scripts():
+		robo = make_eyes( clock )
+		atlas = robo.load_atlas( directory, build=False )
+		for wait, action in script + [ (1500, None) ]:
+			end = clock() + wait
+			while ticks_diff( clock(), end ) < 0:
+				drawn = robo.fpsTimer
+				robo.update()
+				frames += robo.fpsTimer != drawn
+				advance( robo )
+			if action is not None:
+				action( robo )
+		hits += atlas.hits
+		misses += atlas.misses
+	return hits, misses, frames
+
+def summary( name, hits, misses, frames ):
+	print( "%-12s frames %5d  eyes %5d  atlas hits %5d  misses %5d  (%.1f%% hit)" % ( name,
+		frames, hits + misses, hits, misses, 100 * hits / max( 1, hits + misses ) ) )
+
+with tempfile.TemporaryDirectory() as directory:
+	start = time.perf_counter()
+	path = EyeAtlas.build( directory, make_eyes( lambda: 0 ) )
+	print( "%s built in %.1f s" % ( EyeAtlas( path ), time.perf_counter() - start ) )
+
+	now = [ 0 ]
+	def step( robo ):
+		now[0] = robo.next_frame_at()
+	summary( "simulated", *play( directory, lambda: now[0], step ) )
+
+	random.seed( 1 )
+	def late( robo ):
+		now[0] = robo.next_frame_at() + random.randint( 0, jitter )
+	summary( "jitter %d ms" % jitter, *play( directory, lambda: now[0], late ) )
+
+	if real:
+		def sleep( robo ):
+			time.sleep( max( 0, robo.next_frame_in() or 0 ) / 1000 )
+		summary( "real", *play( directory, lambda: int( time.perf_counter() * 1000 ), sleep ) )
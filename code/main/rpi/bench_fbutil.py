@@ -0,0 +1,139 @@
+# Micro-benchmark of the FBUtil shape routines
+#
+# Compares the previous routines against the current ones, without and with the mask cache,
+# and counts the pixels where both outputs differ:
+#  - fill_circle and fill_oval: math.sin/math.cos evaluated for every degree of every call,
+#    against the cached per radius offset tables (same pixels)
+#  - fill_rrect and fill_triangle: a vline/hline call per column/row, against the span
+#    rasterizer writing one mask with fb.fill_mask() (same pixels)
+#  - circle and oval: a pixel per degree along the trig perimeter, against the midpoint
+#    outline (differs on purpose: no doubled pixels and no gaps).
+#
+# Run it on the robot to get Pi Zero numbers:
+#
+#    python3 bench_fbutil.py [radius]
+#
+# Drawing goes to an in-memory framebuffer, /dev/fb0 is not touched.
+#
+import math
+import sys
+import timeit
+
+from display_fbgen import Framebuffer
+from fbbackend import MemoryBackend
+from fbutil import FBUtil
+
+RADIUS = int( sys.argv[1] ) if len( sys.argv ) > 1 else 23
+WIDTH, HEIGHT = 480, 320
+
+def make_fb():
+	return Framebuffer( WIDTH, HEIGHT, pixel_format="RGB565", backend=MemoryBackend( WIDTH, HEIGHT, 16 ) )
+
+class TrigFBUtil( FBUtil ):
+	""" The previous implementation of the routines, kept here for comparison """
+	def _peri_x(self, x, degrees, radius):
+		return int( x + radius*math.sin( math.radians(degrees) ) )
+
+	def _peri_y(self, y, degrees, radius):
+		return int( y - radius*math.cos( math.radians(degrees) ) )
+
+	def circle( self, x, y, radius, color, border=1, degrees=360, startangle=0):
+		border = 5 if border > 5 else border
+		if startangle > 0:
+			degrees += startangle
+		if border > 1:
+			x = x - border//2
+			y = y - border//2
+			radius = radius-border//2
+		for i in range(startangle, degrees):
+			X = self._peri_x(x, i, radius)
+			Y = self._peri_y(y, i, radius)
+			if   i == 90:  X = X-1
+			elif i == 180: Y = Y-1
+			if border==1:
+				self.fb.pixel( X,Y, color )
+			else:
+				self.fb.rect(X, Y, border, border, color )
+
+	def fill_circle(self, x, y, radius, color):
+		tempY = 0
+		for i in range(180):
+			xNeg = self._peri_x(x, 360-i, radius-1)
+			xPos = self._peri_x(x, i, radius)
+			if i > 89:
+				Y = self._peri_y(y, i, radius-1)
+			else:
+				Y = self._peri_y(y, i, radius+1)
+			if i == 90: xPos = xPos-1
+			if tempY != Y and tempY > 0:
+				self.fb.hline(xNeg, Y, xPos+1-xNeg, color )
+			tempY = Y
+
+	def oval( self, x, y, xradius, yradius, color, border=1, degrees=360, startangle=0):
+		border = 5 if border > 5 else border
+		if startangle > 0:
+			degrees += startangle
+		if border > 1:
+			x = x - border//2
+			y = y - border//2
+			xradius = xradius-border//2
+			yradius = yradius-border//2
+		for i in range(startangle, degrees):
+			X = self._peri_x(x, i, xradius)
+			Y = self._peri_y(y, i, yradius)
+			if   i == 90:  X = X-1
+			elif i == 180: Y = Y-1
+			if border==1:
+				self.fb.pixel( X,Y, color )
+			else:
+				self.fb.rect(X, Y, border, border, color )
+
+	def fill_oval( self, x, y, xradius, yradius, color ):
+		tempY = 0
+		for i in range(180):
+			xNeg = self._peri_x(x, 360-i, xradius)
+			xPos = self._peri_x(x, i, xradius)
+			Y	= self._peri_y(y, i, yradius)
+			if i > 89: Y = Y-1
+			if tempY != Y and tempY > 0:
+				self.fb.hline(xNeg, Y, xPos+1-xNeg, color )
+			tempY = Y
+
+class LineFB:
+	""" The framebuffer without fill_mask(), FBUtil then draws the filled shapes line by line """
+	def __init__( self, fb ):
+		self._fb = fb
+
+	def __getattr__( self, name ):
+		if name == "fill_mask":
+			raise AttributeError( name )
+		return getattr( self._fb, name )
+
+old_fb, new_fb = make_fb(), make_fb()
+old, new, cached = TrigFBUtil( LineFB( old_fb ) ), FBUtil( new_fb, cache_bytes=0 ), FBUtil( new_fb )
+white = new_fb.color( [255, 255, 255, 255] )
+r = RADIUS
+
+cases = [
+	# name, call on an FBUtil
+	( "circle", lambda g: g.circle( 240, 160, r, white ) ),
+	( "circle 90deg arc", lambda g: g.circle( 240, 160, r, white, degrees=90, startangle=270 ) ),
+	( "fill_circle", lambda g: g.fill_circle( 240, 160, r, white ) ),
+	( "oval", lambda g: g.oval( 240, 160, r + 10, r, white ) ),
+	( "fill_oval", lambda g: g.fill_oval( 240, 160, r + 10, r, white ) ),
+	( "fill_rrect 170x180", lambda g: g.fill_rrect( 50, 70, 170, 180, r, white ) ),
+	( "fill_triangle lid", lambda g: g.fill_triangle( 50, 69, 220, 69, 50, 69 + 90, white ) ),
+]
+
+number = 500
+print( "radius %d" % r )
+print( "%-20s %12s %12s %8s %12s %6s" % ("routine", "prev calls/s", "calls/s", "speedup", "cached", "diff") )
+for name, call in cases:
+	old_rate = number / min( timeit.repeat( lambda: call( old ), number=number, repeat=3 ) )
+	new_rate = number / min( timeit.repeat( lambda: call( new ), number=number, repeat=3 ) )
+	cached_rate = number / min( timeit.repeat( lambda: call( cached ), number=number, repeat=3 ) )
+	old_fb.fill_screen( 0 ); new_fb.fill_screen( 0 )
+	call( old ); call( new )
+	diff = int( (old_fb.px != new_fb.px).sum() )
+	old_fb.update(); new_fb.update() # drop the damage recorded by the loop
+	print( "%-20s %12.0f %12.0f %7.1fx %12.0f %6d" % (name, old_rate, new_rate, new_rate / old_rate, cached_rate, diff) )
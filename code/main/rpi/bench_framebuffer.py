@@ -0,0 +1,60 @@
+# Micro-benchmark of the Framebuffer primitives
+#
+# Compares the previous primitives (BGRA list broadcast into the (H, W, 4) uint8 buffer on
+# every call) against the current ones drawing a handle from fb.color() into the packed
+# (H, W) uint32 view. Run it on the robot to get Pi Zero numbers:
+#
+#    python3 bench_framebuffer.py
+#
+# The framebuffer is mapped on a temporary file, /dev/fb0 is not touched.
+#
+import os
+import tempfile
+import timeit
+
+from display_fbgen import Framebuffer
+
+WHITE = [255, 255, 255, 255]
+
+tmp = tempfile.NamedTemporaryFile( suffix=".fb", delete=False )
+tmp.close()
+fb = Framebuffer( 480, 320, fb_path=tmp.name, pixel_format="BGRA8888" )
+white = fb.color( WHITE )
+channels = fb.fb # (H, W, 4) uint8, what the primitives used to write into
+
+# The previous implementation of the primitives, kept here for comparison
+def old_hline( x, y, length, color ):
+	if 0 <= y < channels.shape[0]:
+		x_end = min( x + length, channels.shape[1] )
+		x_start = max( x, 0 )
+		if x_start < x_end:
+			channels[y, x_start:x_end] = color
+
+def old_vline( x, y, length, color ):
+	if 0 <= x < channels.shape[1]:
+		y_end = min( y + length, channels.shape[0] )
+		y_start = max( y, 0 )
+		if y_start < y_end:
+			channels[y_start:y_end, x] = color
+
+def old_fill_rect( x, y, w, h, color ):
+	x2 = min( channels.shape[1], x + w )
+	y2 = min( channels.shape[0], y + h )
+	channels[y:y2, x:x2] = color
+
+cases = [
+	# name, previous primitive, current primitive with a color handle
+	( "hline 170px", lambda: old_hline( 50, 100, 170, WHITE ), lambda: fb.hline( 50, 100, 170, white ) ),
+	( "vline 180px", lambda: old_vline( 100, 70, 180, WHITE ), lambda: fb.vline( 100, 70, 180, white ) ),
+	( "fill_rect 170x180", lambda: old_fill_rect( 50, 70, 170, 180, WHITE ), lambda: fb.fill_rect( 50, 70, 170, 180, white ) ),
+]
+
+number = 10000
+print( "%-20s %14s %14s %8s" % ("primitive", "list calls/s", "handle calls/s", "speedup") )
+for name, old, new in cases:
+	old_rate = number / min( timeit.repeat( old, number=number, repeat=3 ) )
+	new_rate = number / min( timeit.repeat( new, number=number, repeat=3 ) )
+	fb.update() # drop the damage recorded by the loop
+	print( "%-20s %14.0f %14.0f %7.1fx" % (name, old_rate, new_rate, new_rate / old_rate) )
+
+os.unlink( tmp.name )
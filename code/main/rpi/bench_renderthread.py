@@ -0,0 +1,79 @@
+# Frame timing under blocking I/O, with and without the render thread
+#
+# Runs the eyes for a few seconds while "sensor polls" block the main thread (a sleep
+# standing for a serial readline() waiting on its timeout), and reports how late the frames
+# were drawn compared to their deadline:
+#   loop     one thread, the main.py loop before asyncio: update() then the poll
+#   thread   RenderThread draws, the main thread polls and posts the mood changes
+#
+#    python3 bench_renderthread.py [seconds] [frame rate]
+#
+import random
+import sys
+import time
+
+from roboeyes import *
+from display_fbgen import Framebuffer
+from fbbackend import NullBackend
+from renderthread import RenderThread
+
+seconds = float( sys.argv[1] ) if len(sys.argv) > 1 else 6
+fps = int( sys.argv[2] ) if len(sys.argv) > 2 else 15
+POLL_INTERVAL = 1.0 # s between two polls
+POLL_BLOCKS = ( 0.1, 0.9 ) # s a poll blocks, at random
+
+def make_eyes():
+	fb = Framebuffer( 480, 320, pixel_format="RGB565", backend=NullBackend( 480, 320, 16 ) )
+	robo = RoboEyes( fb, 480, 320, frame_rate=fps, on_show=lambda robo: None )
+	robo.set_auto_blinker( ON, 1, 1 )
+	robo.set_idle_mode( ON, 1, 1 )
+	return robo
+
+def poll():
+	# a sensor read: blocks, then tells the mood
+	time.sleep( random.uniform( *POLL_BLOCKS ) )
+	return random.choice( ( HAPPY, DEFAULT ) )
+
+def summary( name, late, blocked ):
+	late = sorted( late )
+	print( "%-7s frames %4d  late mean %6.1f ms  p99 %6.1f ms  max %6.1f ms  (main thread blocked %.1f s)" % ( name,
+		len( late ), sum( late ) / len( late ), late[ len( late ) * 99 // 100 ], late[-1], blocked ) )
+
+def run_loop():
+	robo = make_eyes()
+	late = []
+	blocked = 0
+	next_poll = time.perf_counter() + POLL_INTERVAL
+	end = time.perf_counter() + seconds
+	while time.perf_counter() < end:
+		due = robo.next_frame_at()
+		drawn = robo.fpsTimer
+		robo.update()
+		if robo.fpsTimer != drawn and drawn:
+			late.append( max( 0, ticks_diff( robo.fpsTimer, due ) ) )
+		if time.perf_counter() >= next_poll:
+			start = time.perf_counter()
+			robo.mood = poll()
+			blocked += time.perf_counter() - start
+			next_poll = time.perf_counter() + POLL_INTERVAL
+		wait = robo.next_frame_in()
+		time.sleep( max( 0, min( (wait if wait != None else 100) / 1000, next_poll - time.perf_counter() ) ) )
+	summary( "loop", late, blocked )
+
+def run_thread():
+	robo = make_eyes()
+	blocked = 0
+	end = time.perf_counter() + seconds
+	with RenderThread( robo ) as renderer:
+		while time.perf_counter() < end:
+			time.sleep( min( POLL_INTERVAL, max( 0, end - time.perf_counter() ) ) )
+			start = time.perf_counter()
+			renderer.eyes.mood = poll()
+			blocked += time.perf_counter() - start
+	summary( "thread", list( renderer.lateness ), blocked )
+	print( renderer )
+
+random.seed( 1 )
+run_loop()
+random.seed( 1 )
+run_thread()
@@ -0,0 +1,83 @@
+# Headless RoboEyes render benchmark
+#
+# Renders a fixed animation (moods, blinks, flicker) without a display and reports frames
+# per second plus a hash of the frames, so a change in the drawing code that alters the
+# output or the speed shows up before flashing the robot.
+#
+#    python3 bench_roboeyes.py [memory|file|null] [RGB565|BGRA8888|RGB888] [frames] [snapshot dir] [--paint|--list]
+#
+# --paint draws the eyes the old way (clear, eyes, lids painted over them) instead of
+# composing them, --list records each frame as a display list and only replays the parts
+# that changed since the previous frame, to compare the pixels written per frame.
+#
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+import roboeyes
+from roboeyes import *
+from display_fbgen import Framebuffer
+from fbbackend import MemoryBackend, FileBackend, NullBackend
+
+paint = "--paint" in sys.argv
+if paint:
+	sys.argv.remove( "--paint" )
+display_list = "--list" in sys.argv
+if display_list:
+	sys.argv.remove( "--list" )
+kind = sys.argv[1] if len(sys.argv) > 1 else "memory"
+fmt = sys.argv[2] if len(sys.argv) > 2 else "RGB565"
+frames = int( sys.argv[3] ) if len(sys.argv) > 3 else 300
+snapshot_dir = sys.argv[4] if len(sys.argv) > 4 else None
+
+bpp = { "RGB565": 16, "RGB888": 24, "BGRA8888": 32 }[fmt]
+if kind == "file":
+	backend = FileBackend( tempfile.mktemp( suffix=".fb" ), 480, 320, bpp )
+elif kind == "null":
+	backend = NullBackend( 480, 320, bpp )
+else:
+	backend = MemoryBackend( 480, 320, bpp )
+
+lcd = Framebuffer( pixel_format=fmt, backend=backend, hash_frames=True,
+	snapshots=snapshot_dir and (snapshot_dir + "/frame_%05d.png") )
+
+crc = 0
+pixels = 0
+def robo_show( roboeyes ):
+	global crc, pixels
+	pixels += roboeyes.pixels_written
+	lcd.update()
+	crc = zlib.crc32( str(lcd.stats.hash).encode(), crc )
+
+# same random eye positions and blink timings on every run
+random.seed( 1234 )
+roboeyes.randint = random.randint
+
+# animations run on a simulated clock, 50 ms per frame (20 fps): the frames do not depend
+# on how fast this machine renders them
+clock_ms = 0
+robo = RoboEyes( lcd, 480, 320, frame_rate=20, on_show=robo_show, clock=lambda: clock_ms )
+robo.compose = not (paint or display_list)
+robo.display_list = display_list
+robo.set_auto_blinker( ON, 2, 2 ) # blink every 2-4 s and move every 2-3 s of simulated time:
+robo.set_idle_mode( ON, 2, 1 )    # most frames draw open eyes
+
+heights = 0
+moods = [ DEFAULT, TIRED, ANGRY, HAPPY, FROZEN, SCARY, CURIOUS ]
+start = time.perf_counter()
+for frame in range( frames ):
+	if frame % 40 == 0:
+		robo.mood = moods[ (frame // 40) % len(moods) ]
+	robo.draw_eyes()
+	heights += robo.eyeLheightCurrent
+	clock_ms += 50
+elapsed = time.perf_counter() - start
+
+print( "%s %s: %d frames in %.3f s, %.1f fps, %.2f ms/frame" % (kind, fmt, frames, elapsed, frames / elapsed, 1000 * elapsed / frames) )
+print( "bytes presented: %d, frames hash: %08x" % (lcd.stats.total_bytes, crc) )
+print( "pixels written per frame: %d (%.2f per screen pixel)" % (pixels // frames, pixels / frames / (480*320)) )
+print( "mean eye height: %.1f px" % (heights / frames) )
+print( "skipped static frames: %d" % robo.skipped_frames )
+print( robo.gfx.cache )
@@ -1,49 +1,468 @@
 #!/usr/bin/env python3
+import mmap
+import zlib
+
 import numpy as np
 
+from fbbackend import open_backend, write_image
+
+
+class PresentStats:
+	""" Counters describing what update() sent to the device. """
+	__slots__ = [ "frames", "flips", "rects", "rows", "bytes", "synced", "total_bytes", "carried_bytes", "hash" ]
+
+	def __init__( self ):
+		self.frames = 0 # number of update() calls
+		self.flips = 0 # number of page flips (page_flip mode)
+		self.rects = 0 # merged dirty rectangles in the last frame
+		self.rows = 0 # rows copied in the last frame
+		self.bytes = 0 # bytes copied in the last frame
+		self.synced = 0 # bytes flushed (page aligned) in the last frame
+		self.total_bytes = 0 # bytes copied since creation
+		# bytes copied between back buffers by swap_back() since creation. Counted apart:
+		# swap_back() runs on the drawing thread, update() on the presenter's
+		self.carried_bytes = 0
+		self.hash = None # CRC32 of the last presented frame (Framebuffer hash_frames=True)
+
+	def __repr__( self ):
+		return "PresentStats(frames=%d, flips=%d, rects=%d, rows=%d, bytes=%d, synced=%d, total_bytes=%d, carried_bytes=%d, hash=%s)" % (
+			self.frames, self.flips, self.rects, self.rows, self.bytes, self.synced, self.total_bytes,
+			self.carried_bytes, self.hash )
+
+
+class PixelFormat:
+	""" How one pixel is laid out in memory. Colors are written as BGRA lists throughout
+	    RoboEyes; pack() converts such a list once into the native value to draw with. """
+	def __init__( self, name, bpp, dtype, channels, word=None ):
+		self.name = name
+		self.bpp = bpp # bits per pixel
+		self.dtype = np.dtype( dtype ) # element type of the buffer
+		self.channels = channels # elements per pixel, 1 for packed formats
+		self.bytes_per_pixel = bpp // 8
+		# machine word holding a whole pixel, None when there is no such word (24bpp)
+		self.word = np.dtype( word ) if word else None
+
+	def shape( self, height, width ):
+		""" Shape of a (height, width) buffer in this format. """
+		if self.channels == 1:
+			return (height, width)
+		return (height, width, self.channels)
+
+	def packed( self, buf ):
+		""" (H, W) view of buf with one word per pixel, buf itself when it is already packed
+		    or the format has no pixel word. """
+		if buf.ndim == 3 and self.word is not None:
+			return buf.view( self.word )[..., 0]
+		return buf
+
+	def unpacked( self, buf ):
+		""" Inverse of packed(): (H, W, channels) view of a (H, W) buffer of pixel words. """
+		if buf.ndim == 2 and self.channels > 1:
+			return buf.view( np.uint8 ).reshape( buf.shape + (self.channels,) )
+		return buf
+
+	def to_rgb( self, buf ):
+		""" (H, W, 3) uint8 RGB copy of a buffer in this format, for snapshots. """
+		if self.name == "RGB565":
+			v = buf.astype( np.uint16 )
+			r = (v >> 11) & 0x1F
+			g = (v >> 5) & 0x3F
+			b = v & 0x1F
+			return np.dstack( ((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)) ).astype( np.uint8 )
+		return np.ascontiguousarray( buf[..., 2::-1] ) # B, G, R(, A) -> R, G, B
+
+	def pack( self, color ):
+		""" Convert a [B, G, R, A] list into the native pixel value, a single word when the format
+		    has one. Anything else (a scalar or an already packed value) is returned unchanged. """
+		if not isinstance( color, (list, tuple) ):
+			return color
+		b, g, r = color[0], color[1], color[2]
+		if self.name == "RGB565":
+			return np.uint16( ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3) )
+		if self.name == "RGB888":
+			return np.array( (b, g, r), dtype=np.uint8 ) # stored B, G, R like fbdev's 24bpp
+		return np.array( color, dtype=np.uint8 ).view( np.uint32 )[0]
+
+	def __repr__( self ):
+		return "PixelFormat(%s)" % self.name
+
+
+RGB565 = PixelFormat( "RGB565", 16, np.uint16, 1, word=np.uint16 )
+RGB888 = PixelFormat( "RGB888", 24, np.uint8, 3 )
+BGRA8888 = PixelFormat( "BGRA8888", 32, np.uint8, 4, word=np.uint32 )
+PIXEL_FORMATS = { f.name: f for f in (RGB565, RGB888, BGRA8888) }
+PIXEL_FORMATS_BY_BPP = { f.bpp: f for f in (RGB565, RGB888, BGRA8888) }
+
+
+def merge_rects( rects ):
+	""" Merge (x0, y0, x1, y1) rectangles whose rows overlap or touch into their bounding boxes.
+	    Returned rectangles are sorted by y0 and never share a row. """
+	merged = []
+	for x0, y0, x1, y1 in sorted( rects, key=lambda r: r[1] ):
+		if merged and y0 <= merged[-1][3]:
+			mx0, my0, mx1, my1 = merged[-1]
+			merged[-1] = ( min(mx0, x0), my0, max(mx1, x1), max(my1, y1) )
+		else:
+			merged.append( (x0, y0, x1, y1) )
+	return merged
+
+def subtract_rects( rects, cuts ):
+	""" The parts of the (x0, y0, x1, y1) rectangles outside all the cuts rectangles, as
+	    non-overlapping rectangles. """
+	for cx0, cy0, cx1, cy1 in cuts:
+		left = []
+		for x0, y0, x1, y1 in rects:
+			if cx0 >= x1 or cx1 <= x0 or cy0 >= y1 or cy1 <= y0:
+				left.append( (x0, y0, x1, y1) )
+				continue
+			# bands above and below the cut, then the parts left and right of it
+			if y0 < cy0:
+				left.append( (x0, y0, x1, cy0) )
+			if cy1 < y1:
+				left.append( (x0, cy1, x1, y1) )
+			my0 = max( y0, cy0 )
+			my1 = min( y1, cy1 )
+			if x0 < cx0:
+				left.append( (x0, my0, cx0, my1) )
+			if cx1 < x1:
+				left.append( (cx1, my0, x1, my1) )
+		rects = left
+	return rects
+
+
 class Framebuffer:
-	def __init__(self, width=480, height=320, fb_path='/dev/fb0'):
-		self.width = width
-		self.height = height
-		self.channels = 4  # BGRA
-		self.fb = np.zeros((height, width, self.channels), dtype=np.uint8)
-		self.fb_mem = np.memmap(fb_path, dtype='uint8', mode='w+', shape=(self.height, self.width, self.channels))
+	def __init__(self, width=None, height=None, fb_path='/dev/fb0', pixel_format=None, direct=False, page_flip=False,
+			indexed=False, backend=None, hash_frames=False, snapshots=None):
+		"""Width, height and pixel format default to what the device reports (480x320 BGRA
+		   for plain files). With direct=True there is no back buffer: drawing goes straight
+		   into the mapping and update() only syncs the dirty pages.
+		   With page_flip=True and a virtual height of at least twice the visible one, drawing
+		   goes to the hidden half of the mapping and update() pans to it (FBIOPAN_DISPLAY)
+		   instead of copying. Falls back to copy mode when the driver cannot pan, check
+		   self.page_flip afterwards.
+		   With indexed=True the back buffer holds one uint8 palette index per pixel; color()
+		   hands out indexes and update() expands the dirty rows through self.palette.
+		   backend replaces fb_path with one of the fbbackend classes (in-memory, file, null
+		   sink). hash_frames stores a CRC32 of each presented frame in self.stats.hash and
+		   snapshots (e.g. "frames/%05d.png") dumps every presented frame as PNG or PPM."""
+		if indexed and direct:
+			raise ValueError("indexed mode needs a back buffer, it cannot be direct")
+		if isinstance(pixel_format, str):
+			pixel_format = PIXEL_FORMATS[pixel_format]
+		if backend is None:
+			backend = open_backend(fb_path, width, height, pixel_format.bpp if pixel_format else None)
+		self.backend = backend
+		self.info = backend.info
+		if pixel_format is None:
+			pixel_format = PIXEL_FORMATS_BY_BPP.get(self.info.bpp, BGRA8888)
+		self.width = width or self.info.width
+		self.height = height or self.info.height
+		self.format = pixel_format
+		self.channels = pixel_format.channels
+		self._row_bytes = self.width * pixel_format.bytes_per_pixel
+		# bytes per row in the mapping, including any padding the driver adds
+		self.stride = self.info.stride
+		self.hash_frames = hash_frames
+		self.snapshots = snapshots
+
+		pages = 1
+		if page_flip and self.info.virtual_height >= 2 * self.height:
+			try:
+				backend.pan(0) # also checks that the driver supports panning
+				pages = 2
+			except OSError:
+				pass
+		self.page_flip = pages == 2
+		self.indexed = indexed
+
+		self._size = self.stride * self.height * pages
+		self._mmap = backend.map(pages) # None for the null sink
+		if self._mmap is None:
+			pages = 0
+		# drawing goes to the mapping itself, except in indexed mode which always needs expanding
+		self.direct = (direct or self.page_flip) and not indexed and pages > 0
+		shape = pixel_format.shape(self.height, self.width)
+		strides = (self.stride, pixel_format.bytes_per_pixel, 1)[:len(shape)]
+		self._pages = [ np.ndarray(shape, dtype=pixel_format.dtype, buffer=self._mmap,
+			offset=page * self.stride * self.height, strides=strides) for page in range(pages) ]
+		self._shown = 0 # index of the page on screen
+		self.fb_mem = self._pages[0] if pages else None # what is on screen
+		if indexed:
+			self._set_back(np.zeros((self.height, self.width), dtype=np.uint8))
+		elif self.page_flip:
+			self._set_back(self._pages[1])
+		elif direct:
+			self._set_back(self.fb_mem)
+		else:
+			self._set_back(np.zeros(shape, dtype=pixel_format.dtype))
+		# indexed mode: native pixel value for each index, and the BGRA color -> index lookup
+		if pixel_format.word is not None:
+			self.palette = np.zeros(256, dtype=pixel_format.word)
+		else:
+			self.palette = np.zeros((256,) + shape[2:], dtype=pixel_format.dtype)
+		self._palette_index = {}
+		# indexed page_flip mode: rows of the hidden page that are one frame behind
+		self._stale = []
+		# after a flip the new back page is one frame behind; these rows are copied over
+		# from the page on screen (or _carry_from) before the next drawing, dropped if it
+		# fills the screen
+		self._carry = None
+		self._carry_from = None
+		self._presented = None # last buffer given to present()
+
+		# Damage tracking: list of (x0, y0, x1, y1) rectangles drawn since the last update().
+		# None means "unknown", update() then diffs rows against the last presented frame.
+		self._damage = None
+		self.stats = PresentStats()
+		# pixels written by the drawing methods since creation, overdraw included
+		self.pixels_written = 0
+		# drawing methods only touch this (x0, y0, x1, y1) rectangle, see set_clip()
+		self._clip = (0, 0, self.width, self.height)
+		# DisplayList the drawing methods append to instead of drawing, see begin_record()
+		self.recording = None
+
+	@property
+	def fb(self):
+		"""The buffer drawn into (back buffer, hidden page, or the mapping in direct mode)."""
+		if self._carry:
+			self._apply_carry()
+		return self._back
+
+	@property
+	def px(self):
+		"""Same memory as fb with one word per pixel ((H, W) uint32 for BGRA8888), the view the
+		   drawing methods write the handles returned by color() into."""
+		if self._carry:
+			self._apply_carry()
+		return self._px
+
+	def _set_back(self, back):
+		self._back = back
+		self._px = self.format.packed(back)
+
+	def _apply_carry(self):
+		source = self.fb_mem if self._carry_from is None else self._carry_from
+		carried = 0
+		for _x0, y0, _x1, y1 in self._carry:
+			self._back[y0:y1] = source[y0:y1]
+			carried += (y1 - y0) * self._row_bytes
+		self._carry = None
+		self._carry_from = None
+		self.stats.carried_bytes += carried
+
+	def swap_back(self, back, carry=None):
+		"""Draw into another buffer (same shape and dtype as fb) from now on; returns the
+		   previous one together with its damage (None when unknown). The rows in carry are
+		   copied from the previous buffer into the new one before anything is drawn into it,
+		   unless the next drawing fills the screen. Used by presenters doing their own buffering."""
+		if self._carry:
+			self._apply_carry()
+		previous, damage = self._back, self.dirty_rects()
+		self._set_back(back)
+		self._damage = []
+		self._carry = carry
+		self._carry_from = previous
+		return previous, damage
+
+	def _pan(self, page):
+		self.backend.pan(page)
+
+	def close(self):
+		self.backend.close()
+
+	def _add_damage(self, x0, y0, x1, y1):
+		if self._damage is not None:
+			self._damage.append((x0, y0, x1, y1))
+
+	def invalidate(self, x=None, y=None, w=None, h=None):
+		"""Mark a region as changed after writing self.fb directly. Without arguments the
+		   next update() diffs every row against the last presented frame."""
+		if x is None:
+			self._damage = None
+		else:
+			self._add_damage(max(x, 0), max(y, 0), min(self.width, x + w), min(self.height, y + h))
+
+	def color(self, color):
+		"""Convert a BGRA list into a handle for the native pixel value: a single word (e.g.
+		   np.uint32 for BGRA8888) or a palette index in indexed mode. Convert colors once and
+		   pass the handle to the drawing methods, each fill is then a one-word broadcast."""
+		if not self.indexed:
+			return self.format.pack(color)
+		if not isinstance(color, (list, tuple)):
+			return color
+		key = tuple(color)
+		index = self._palette_index.get(key)
+		if index is None:
+			index = len(self._palette_index)
+			if index >= len(self.palette):
+				raise ValueError("palette is full")
+			self._palette_index[key] = index
+			self.palette[index] = self.format.pack(color)
+		return index
+
+	def set_palette(self, index, color):
+		"""Indexed mode: show every pixel drawn with index in another BGRA color, without
+		   redrawing (e.g. dimming at night, mood colors). The next update() rewrites the screen."""
+		self.palette[index] = self.format.pack(color)
+		for key, value in list(self._palette_index.items()):
+			if value == index:
+				del self._palette_index[key]
+		self._palette_index.setdefault(tuple(color), index)
+		self._damage = [(0, 0, self.width, self.height)]
 
 	def fill(self,bgcolor ):
 		self.fill_screen( bgcolor )
 
+	def set_clip(self, x0=None, y0=None, x1=None, y1=None):
+		"""Restrict the drawing methods to the rectangle (x0, y0)-(x1, y1), x1/y1 excluded.
+		   Without arguments drawing covers the whole screen again."""
+		if x0 is None:
+			self._clip = (0, 0, self.width, self.height)
+		else:
+			self._clip = (max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height))
+
+	def begin_record(self, display_list=None):
+		"""From now on the drawing methods (and the FBUtil shapes drawn on this Framebuffer)
+		   are appended to a DisplayList instead of being drawn; returns that list."""
+		if display_list is None:
+			from displaylist import DisplayList # displaylist imports this module
+			display_list = DisplayList(self.width, self.height)
+		self.recording = display_list
+		return display_list
+
+	def end_record(self):
+		"""Stop recording, returns the DisplayList."""
+		display_list, self.recording = self.recording, None
+		return display_list
+
 	def fill_screen(self, color):
-		"""Fill the entire screen with a BGRA color."""
-		self.fb[:] = color
+		"""Fill the entire screen (the clip rectangle) with a color."""
+		if self.recording is not None:
+			return self.recording.record("fill_screen", (), color)
+		color = self.color(color)
+		cx0, cy0, cx1, cy1 = self._clip
+		if (cx0, cy0, cx1, cy1) != (0, 0, self.width, self.height):
+			if cx0 < cx1 and cy0 < cy1:
+				self.px[cy0:cy1, cx0:cx1] = color
+				self._add_damage(cx0, cy0, cx1, cy1)
+				self.pixels_written += (cx1 - cx0) * (cy1 - cy0)
+			return
+		self._carry = self._carry_from = None # everything gets overwritten
+		self._px[:] = color
+		self._damage = [(0, 0, self.width, self.height)]
+		self.pixels_written += self.width * self.height
 
 	def fill_rect(self, x, y, w, h, color):
 		"""Fill a rectangle starting at (x,y) with width w and height h."""
-		x2 = min(self.width, x + w)
-		y2 = min(self.height, y + h)
-		self.fb[y:y2, x:x2] = color
+		if self.recording is not None:
+			return self.recording.record("fill_rect", (x, y, w, h), color)
+		color = self.color(color)
+		cx0, cy0, cx1, cy1 = self._clip
+		x2 = min(cx1, x + w)
+		y2 = min(cy1, y + h)
+		x = max(x, cx0)
+		y = max(y, cy0)
+		if x < x2 and y < y2:
+			self.px[y:y2, x:x2] = color
+			self._add_damage(x, y, x2, y2)
+			self.pixels_written += (x2 - x) * (y2 - y)
 
 	def pixel(self, x, y, color):
-		"""Draw a single pixel at (x, y) with a BGRA color."""
-		if 0 <= x < self.width and 0 <= y < self.height:
-			self.fb[y, x] = color
+		"""Draw a single pixel at (x, y) with a color."""
+		if self.recording is not None:
+			return self.recording.record("pixel", (x, y), color)
+		color = self.color(color)
+		cx0, cy0, cx1, cy1 = self._clip
+		if cx0 <= x < cx1 and cy0 <= y < cy1:
+			self.px[y, x] = color
+			self._add_damage(x, y, x + 1, y + 1)
+			self.pixels_written += 1
 
 	def vline(self, x, y, length, color):
-		"""Draw a vertical line from (x, y) of given length and BGRA color."""
-		if 0 <= x < self.fb.shape[1]:
-			y_end = min(y + length, self.fb.shape[0])
-			y_start = max(y, 0)
+		"""Draw a vertical line from (x, y) of given length and color."""
+		if self.recording is not None:
+			return self.recording.record("vline", (x, y, length), color)
+		color = self.color(color)
+		cx0, cy0, cx1, cy1 = self._clip
+		if cx0 <= x < cx1:
+			y_end = min(y + length, cy1)
+			y_start = max(y, cy0)
 			if y_start < y_end:
-				self.fb[y_start:y_end, x] = color
+				self.px[y_start:y_end, x] = color
+				self._add_damage(x, y_start, x + 1, y_end)
+				self.pixels_written += y_end - y_start
 
 	def hline(self, x, y, length, color):
-		"""Draw a horizontal line from (x, y) of given length and BGRA color."""
-		if 0 <= y < self.fb.shape[0]:
-			x_end = min(x + length, self.fb.shape[1])
-			x_start = max(x, 0)
+		"""Draw a horizontal line from (x, y) of given length and color."""
+		if self.recording is not None:
+			return self.recording.record("hline", (x, y, length), color)
+		color = self.color(color)
+		cx0, cy0, cx1, cy1 = self._clip
+		if cy0 <= y < cy1:
+			x_end = min(x + length, cx1)
+			x_start = max(x, cx0)
 			if x_start < x_end:
-				self.fb[y, x_start:x_end] = color
+				self.px[y, x_start:x_end] = color
+				self._add_damage(x_start, y, x_end, y + 1)
+				self.pixels_written += x_end - x_start
+
+	def fill_mask(self, x, y, mask, color):
+		"""Fill the pixels set in a boolean (h, w) mask placed with its top left corner at (x, y),
+		   in one batched write. Used for the shapes FBUtil rasterizes into spans."""
+		if self.recording is not None:
+			return self.recording.record("fill_mask", (x, y, mask), color)
+		color = self.color(color)
+		h, w = mask.shape
+		cx0, cy0, cx1, cy1 = self._clip
+		x0 = max(x, cx0)
+		y0 = max(y, cy0)
+		x1 = min(cx1, x + w)
+		y1 = min(cy1, y + h)
+		if x0 < x1 and y0 < y1:
+			view = self.px[y0:y1, x0:x1]
+			where = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+			self.pixels_written += int(np.count_nonzero(where))
+			if view.ndim == 3: # no pixel word (RGB888), the mask covers all channels
+				where = where[..., None]
+			np.copyto(view, color, where=where)
+			self._add_damage(x0, y0, x1, y1)
+
+	def compose(self, x, y, mask, color, bgcolor):
+		"""Fill the screen (the clip rectangle) with bgcolor except the pixels set in mask (placed
+		   at (x, y)), which get color. Each pixel is written once, unlike fill_screen() followed
+		   by fill_mask()."""
+		if self.recording is not None:
+			self.recording.record("fill_screen", (), bgcolor)
+			return self.recording.record("fill_mask", (x, y, mask), color)
+		color = self.color(color)
+		bgcolor = self.color(bgcolor)
+		h, w = mask.shape
+		cx0, cy0, cx1, cy1 = self._clip
+		x0 = max(x, cx0)
+		y0 = max(y, cy0)
+		x1 = min(cx1, x + w)
+		y1 = min(cy1, y + h)
+		if not (x0 < x1 and y0 < y1):
+			self.fill_screen(bgcolor)
+			return
+		if (cx0, cy0, cx1, cy1) == (0, 0, self.width, self.height):
+			self._carry = self._carry_from = None # everything gets overwritten
+			self._damage = []
+		px = self.px
+		where = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+		if px.ndim == 3:
+			where = where[..., None]
+		px[y0:y1, x0:x1] = np.where(where, color, bgcolor)
+		# the bands around the mask
+		px[cy0:y0, cx0:cx1] = bgcolor
+		px[y1:cy1, cx0:cx1] = bgcolor
+		px[y0:y1, cx0:x0] = bgcolor
+		px[y0:y1, x1:cx1] = bgcolor
+		self._add_damage(cx0, cy0, cx1, cy1)
+		self.pixels_written += (cx1 - cx0) * (cy1 - cy0)
 
 	def rect(self, x, y, w, h, color):
+		color = self.color(color)
 		self.hline(x,y,w,color)
 		self.hline(x,y+h,w,color)
 		self.vline(x,y,h,color)
@@ -53,6 +472,141 @@ class Framebuffer:
 		"""Clear the screen to black."""
 		self.fill_screen([0, 0, 0, 255])
 
+	def dirty_rects(self):
+		"""Merged rectangles changed since the last update(), None when unknown."""
+		if self._damage is None:
+			return None
+		return merge_rects(self._damage)
+
+	def _diff_rows(self, source):
+		"""Row-diff fallback: rows of source that differ from the presented frame."""
+		source = self.format.packed(source)
+		back = np.take(self.palette, source, axis=0) if self.indexed else source
+		changed = np.any((back != self.format.packed(self.fb_mem)).reshape(self.height, -1), axis=1)
+		rows = np.flatnonzero(changed)
+		if len(rows) == 0:
+			return []
+		# split the changed row indices into contiguous runs
+		breaks = np.flatnonzero(np.diff(rows) > 1)
+		starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+		ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+		return [(0, int(y0), self.width, int(y1)) for y0, y1 in zip(starts, ends)]
+
+	def _sync(self, rects, base=None):
+		"""msync the pages holding the rows of rects, returns the number of bytes synced."""
+		# neighbouring bands sharing a page are synced together
+		if base is None:
+			base = self._shown * self.stride * self.height
+		page = mmap.PAGESIZE
+		ranges = []
+		for _x0, y0, _x1, y1 in rects:
+			start = (base + y0 * self.stride) // page * page
+			end = min(-(-(base + y1 * self.stride) // page) * page, self._size)
+			if ranges and start <= ranges[-1][1]:
+				ranges[-1][1] = max(ranges[-1][1], end)
+			else:
+				ranges.append([start, end])
+		for start, end in ranges:
+			self.backend.flush(start, end - start)
+		return sum(end - start for start, end in ranges)
+
 	def update(self):
-		self.fb_mem[:] = self.fb[:]
-		self.fb_mem.flush()  # Ensure changes are written to disk
\ No newline at end of file
+		"""Present the back buffer. Only the dirty rows are copied (nothing in direct mode) and
+		   only the pages holding them are synced; see self.stats for what was written.
+		   In page_flip mode the hidden page is shown instead and becomes the front page."""
+		rects = self.dirty_rects()
+		self._damage = []
+		# pending carried rows only matter to the row diff, anything drawn already has them
+		self.present(self._back if rects is not None else self.fb, rects)
+
+	def present(self, source, rects):
+		"""Write the frame in source (fb, or a buffer handed out by swap_back()) to the device.
+		   rects are its merged dirty rectangles, None to diff it against the screen. Can run
+		   on another thread than the drawing (copy mode only)."""
+		if rects is None:
+			if self.fb_mem is None or (self.direct and not self.page_flip):
+				# nothing to diff against in direct mode, sync everything
+				rects = [(0, 0, self.width, self.height)]
+			else:
+				rects = self._diff_rows(source)
+
+		rows = 0
+		if self.page_flip:
+			if rects:
+				back = 1 - self._shown
+				if self.indexed:
+					# the hidden page also misses what the previous frame changed
+					stale, self._stale = merge_rects(rects + self._stale), rects
+					rows = self._copy_rows(stale, self._pages[back])
+					self.stats.synced = self._sync(stale, back * self.stride * self.height)
+				else:
+					self.stats.synced = self._sync(rects, back * self.stride * self.height)
+				try:
+					self._pan(back)
+				except OSError:
+					self._stop_flipping()
+				else:
+					self._shown = back
+					self.fb_mem = self._pages[back]
+					if not self.indexed:
+						self._set_back(self._pages[1 - back])
+						self._carry = rects
+						self._carry_from = None
+					self.stats.flips += 1
+			else:
+				self.stats.synced = 0
+		elif self.fb_mem is None:
+			self.stats.synced = 0 # null sink
+		else:
+			if not self.direct:
+				rows = self._copy_rows(rects, self.fb_mem, source)
+			self.stats.synced = self._sync(rects)
+
+		self._presented = source
+		self.stats.frames += 1
+		self.stats.rects = len(rects)
+		self.stats.rows = rows
+		self.stats.bytes = rows * self._row_bytes
+		self.stats.total_bytes += self.stats.bytes
+		if self.hash_frames:
+			self.stats.hash = zlib.crc32(np.ascontiguousarray(self.frame()))
+		if self.snapshots:
+			self.snapshot(self.snapshots % self.stats.frames)
+
+	def frame(self):
+		"""The presented frame (the back buffer for the null sink) in the native layout."""
+		if self.fb_mem is not None:
+			return self.fb_mem
+		source = self._back if self._presented is None else self._presented
+		if self.indexed:
+			return self.format.unpacked(np.take(self.palette, source, axis=0))
+		return source
+
+	def snapshot(self, path):
+		"""Save the presented frame as PNG (.png) or binary PPM (any other extension)."""
+		write_image(path, self.format.to_rgb(self.frame()))
+
+	def _copy_rows(self, rects, target, source=None):
+		"""Write the rows of rects from source (the back buffer) into target, returns the row count."""
+		# Rows are contiguous in memory, so whole rows are copied
+		if source is None:
+			source = self._back
+		rows = 0
+		for _x0, y0, _x1, y1 in rects:
+			if self.indexed:
+				self.format.packed(target)[y0:y1] = np.take(self.palette, source[y0:y1], axis=0)
+			else:
+				target[y0:y1] = source[y0:y1]
+			rows += y1 - y0
+		return rows
+
+	def _stop_flipping(self):
+		"""Panning failed at runtime: keep drawing into the page on screen, like direct mode
+		   (or copy mode when indexed)."""
+		self.fb_mem = self._pages[self._shown]
+		self._copy_rows([(0, 0, self.width, self.height)], self.fb_mem)
+		if not self.indexed:
+			self._set_back(self.fb_mem)
+		self._carry = self._carry_from = None
+		self._sync([(0, 0, self.width, self.height)])
+		self.page_flip = False
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+""" Display lists: draw calls recorded instead of executed.
+
+	While a Framebuffer records (fb.begin_record() ... fb.end_record()), its drawing methods
+	and the FBUtil shapes drawn on it append an operation to a DisplayList instead of
+	touching pixels. The list can then be worked on as a whole before being replayed:
+
+	  optimized()  drops the operations hidden by a later opaque fill, sorts runs of same
+	               colored operations by row and merges rectangles and spans that join up
+	  damage()     the areas where two lists (e.g. two frames) can draw differently
+	  dumps()      JSON text, DisplayList.loads() reads it back
+	  replay()     draws the operations on a Framebuffer, usually under fb.set_clip() so
+	               only a damaged area is redrawn, skipping the operations outside it
+
+	Colors are stored as given to the drawing methods, usually native handles from
+	fb.color(): replay a list on a Framebuffer with the same pixel format (and palette).
+"""
+import base64
+import difflib
+import json
+
+import numpy as np
+
+from display_fbgen import subtract_rects
+
+# operations executed by the Framebuffer, the others by an FBUtil
+FB_OPS = ( "fill_screen", "fill_rect", "hline", "vline", "pixel", "fill_mask" )
+GFX_OPS = ( "fill_rrect", "fill_triangle", "circle", "oval", "rrect" )
+# where the color goes in the call when it is not the last argument (outlines: border etc. follow)
+COLOR_ARG = { "circle": 3, "oval": 4 }
+
+
+def _color_key( color ):
+	# hashable and comparable form of a color
+	if isinstance( color, np.ndarray ):
+		return tuple( color.tolist() )
+	if isinstance( color, (list, tuple) ):
+		return tuple( color )
+	if isinstance( color, np.generic ):
+		return color.item()
+	return color
+
+def _op_key( op ):
+	name, args, color = op
+	if name == "fill_mask":
+		mask = args[2]
+		args = ( args[0], args[1], mask.shape, hash( mask.tobytes() ) )
+	return ( name, args, _color_key( color ) )
+
+
+class DisplayList:
+	def __init__( self, width, height, ops=None ):
+		self.width = width # screen the operations are clipped to
+		self.height = height
+		self.ops = ops if ops is not None else [] # ( name, args, color ) tuples
+
+	def record( self, name, args, color ):
+		self.ops.append( (name, args, color) )
+
+	def __len__( self ):
+		return len( self.ops )
+
+	def __eq__( self, other ):
+		return isinstance( other, DisplayList ) and [ _op_key( op ) for op in self.ops ] == [ _op_key( op ) for op in other.ops ]
+
+	def __repr__( self ):
+		return "DisplayList(%d ops)" % len( self.ops )
+
+	# --- Geometry -------------------------------------------
+
+	def bbox( self, op ):
+		""" (x0, y0, x1, y1) on screen holding every pixel op draws, () when it draws nothing
+		    and None when that is not known (degenerate shapes). """
+		name, args, _color = op
+		if name == "fill_screen":
+			box = ( 0, 0, self.width, self.height )
+		elif name == "fill_rect":
+			x, y, w, h = args
+			box = ( x, y, x + w, y + h )
+		elif name == "hline":
+			x, y, length = args
+			box = ( x, y, x + length, y + 1 )
+		elif name == "vline":
+			x, y, length = args
+			box = ( x, y, x + 1, y + length )
+		elif name == "pixel":
+			x, y = args
+			box = ( x, y, x + 1, y + 1 )
+		elif name == "fill_mask":
+			x, y, mask = args
+			box = ( x, y, x + mask.shape[1], y + mask.shape[0] )
+		elif name in ("fill_rrect", "rrect"):
+			x, y, w, h = args[:4]
+			if w <= 0 or h <= 0:
+				return None # the rounded corners of a negative box still draw
+			box = ( x, y, x + w, y + h )
+		elif name == "fill_triangle":
+			xs = args[0::2]
+			ys = args[1::2]
+			box = ( min( xs ), min( ys ), max( xs ) + 1, max( ys ) + 1 )
+		elif name in ("circle", "oval"):
+			x, y, xr = args[:3]
+			yr = args[3] if name == "oval" else xr
+			box = ( x - xr, y - yr, x + xr + 1, y + yr + 1 )
+		else:
+			return None
+		x0 = max( box[0], 0 )
+		y0 = max( box[1], 0 )
+		x1 = min( box[2], self.width )
+		y1 = min( box[3], self.height )
+		if x0 >= x1 or y0 >= y1:
+			return ()
+		return ( x0, y0, x1, y1 )
+
+	def _rect( self, op ):
+		# op as (x, y, w, h) when it fills a whole rectangle, None otherwise
+		name, args, _color = op
+		if name == "fill_rect":
+			return args
+		if name == "hline":
+			return ( args[0], args[1], args[2], 1 )
+		if name == "vline":
+			return ( args[0], args[1], 1, args[2] )
+		if name == "pixel":
+			return ( args[0], args[1], 1, 1 )
+		if name == "fill_screen":
+			return ( 0, 0, self.width, self.height )
+		return None
+
+	# --- Optimization ---------------------------------------
+
+	def optimized( self ):
+		""" A new list drawing the same pixels with fewer and better ordered operations. """
+		# 1. cull: walking backwards, drop what a later opaque rectangle covers
+		covers = []
+		kept = []
+		for op in reversed( self.ops ):
+			box = self.bbox( op )
+			if box == ():
+				continue # draws nothing
+			if box is not None and any( c[0] <= box[0] and c[1] <= box[1] and box[2] <= c[2] and box[3] <= c[3] for c in covers ):
+				continue
+			kept.append( op )
+			if box is not None and self._rect( op ) is not None:
+				covers.append( box )
+		kept.reverse()
+
+		# 2. sort: inside a run of one color the painting order does not matter, go row by row
+		ops = []
+		start = 0
+		for i in range( 1, len( kept ) + 1 ):
+			if i == len( kept ) or _color_key( kept[i][2] ) != _color_key( kept[start][2] ):
+				run = kept[start:i]
+				run.sort( key=lambda op: (self.bbox( op ) or (0, 0))[1::-1] )
+				ops.extend( run )
+				start = i
+
+		# 3. merge neighbouring rectangles (spans, lines, fills) of one color into one fill_rect
+		merged = []
+		for op in ops:
+			if merged:
+				joined = self._join( merged[-1], op )
+				if joined is not None:
+					merged[-1] = joined
+					continue
+			merged.append( op )
+		return DisplayList( self.width, self.height, merged )
+
+	def _join( self, a, b ):
+		# fill_rect covering both a and b when they make up a rectangle together, else None
+		if _color_key( a[2] ) != _color_key( b[2] ):
+			return None
+		ra = self._rect( a )
+		rb = self._rect( b )
+		if ra is None or rb is None or a[0] == "fill_screen" or b[0] == "fill_screen":
+			return None
+		ax, ay, aw, ah = ra
+		bx, by, bw, bh = rb
+		if aw <= 0 or ah <= 0 or bw <= 0 or bh <= 0:
+			return None
+		if ax == bx and aw == bw and by <= ay + ah and ay <= by + bh: # stacked
+			y0 = min( ay, by )
+			return ( "fill_rect", (ax, y0, aw, max( ay + ah, by + bh ) - y0), a[2] )
+		if ay == by and ah == bh and bx <= ax + aw and ax <= bx + bw: # side by side
+			x0 = min( ax, bx )
+			return ( "fill_rect", (x0, ay, max( ax + aw, bx + bw ) - x0, ah), a[2] )
+		return None
+
+	# --- Diffing ----------------------------------------------
+
+	def damage( self, previous ):
+		""" Non-overlapping rectangles (x0, y0, x1, y1) where this list can draw differently
+		    than previous (a DisplayList or None for "unknown"). Empty when both draw the same.
+		    They cover the changed operations only: two eyes on the same rows stay apart. """
+		full = [ (0, 0, self.width, self.height) ]
+		if previous is None:
+			return full
+		matcher = difflib.SequenceMatcher( None, [ _op_key( op ) for op in previous.ops ],
+			[ _op_key( op ) for op in self.ops ], autojunk=False )
+		rects = []
+		for tag, i0, i1, j0, j1 in matcher.get_opcodes():
+			if tag == "equal":
+				continue
+			for op in previous.ops[i0:i1] + self.ops[j0:j1]:
+				box = self.bbox( op )
+				if box is None:
+					return full
+				if box:
+					rects += subtract_rects( [ box ], rects )
+		return rects
+
+	# --- Replay -----------------------------------------------
+
+	def replay( self, fb, gfx=None, rect=None ):
+		""" Draw the operations on fb, the FBUtil ones with gfx (an FBUtil on fb). With a
+		    rect (x0, y0, x1, y1), usually the clip of fb, only the operations reaching it. """
+		for op in self.ops:
+			name, args, color = op
+			if rect is not None:
+				box = self.bbox( op )
+				if box == () or box is not None and (box[0] >= rect[2] or rect[0] >= box[2] or box[1] >= rect[3] or rect[1] >= box[3]):
+					continue
+			at = COLOR_ARG.get( name, len( args ) )
+			target = fb if name in FB_OPS else gfx
+			getattr( target, name )( *args[:at], color, *args[at:] )
+
+	# --- Serialization ----------------------------------------
+
+	def dumps( self ):
+		ops = []
+		for name, args, color in self.ops:
+			if name == "fill_mask":
+				x, y, mask = args
+				args = [ x, y, { "shape": list( mask.shape ),
+					"bits": base64.b64encode( np.packbits( mask ) ).decode( "ascii" ) } ]
+			if isinstance( color, np.ndarray ):
+				color = color.tolist()
+			elif isinstance( color, np.generic ):
+				color = color.item()
+			ops.append( [ name, list( args ), color ] )
+		return json.dumps( { "width": self.width, "height": self.height, "ops": ops } )
+
+	@classmethod
+	def loads( cls, text ):
+		data = json.loads( text )
+		ops = []
+		for name, args, color in data["ops"]:
+			if name == "fill_mask":
+				shape = args[2]["shape"]
+				bits = np.frombuffer( base64.b64decode( args[2]["bits"] ), dtype=np.uint8 )
+				args[2] = np.unpackbits( bits, count=shape[0] * shape[1] ).astype( bool ).reshape( shape )
+			ops.append( ( name, tuple( args ), color ) )
+		return cls( data["width"], data["height"], ops )
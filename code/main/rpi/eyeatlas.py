@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+""" Eye atlas: the eyes of the usual animations, rendered ahead of time.
+
+	Blinks, winks and mood transitions draw the same eyes over and over for a given eye
+	geometry. An eye tile is the mask of one eye as composed by RoboEyes (its rounded rect
+	minus its eyelids), keyed by the eye's shapes relative to the eye. The atlas simulates
+	the animations (blink and winks in every mood, every mood transition, curious gazes) at
+	the RoboEyes frame rate, renders the tiles they use with a process pool and stores them
+	in a file that is memory-mapped at runtime, next to a JSON index:
+
+	  eyeatlas-<geometry hash>.bin    the tiles, one byte per pixel
+	  eyeatlas-<geometry hash>.json   geometry and (key, dx, dy, height, width, offset) per tile
+
+	Drawing a frame then takes the tiles of both eyes from the mapping instead of composing
+	the shape masks. Tiles are pixel format independent masks, played back with fb.compose().
+	While an atlas is loaded RoboEyes tweens in whole frameInterval steps, so frames drawn a
+	little late still match the simulated ones. Eyes missing from the atlas (animations not
+	simulated, sizes set at runtime) are composed as usual and kept in a MaskCache.
+
+	robo.load_atlas( "/var/cache/roboeyes" ) # builds the atlas on first boot, before starting threads
+
+	Build it ahead, at install time, for the geometry of main.py:
+
+	python3 eyeatlas.py [directory]
+"""
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fbutil import FBUtil, MaskCache, composite
+
+VERSION = 1 # bump when the tiles of a key change
+UNCLIPPED = ( -1 << 30, -1 << 30, 1 << 30, 1 << 30 )
+
+
+def geometry( robo ):
+	""" What the built tiles depend on: the eye geometry set with the eyes_*() methods,
+	    cyclops mode and the frame rate the animations are simulated at. """
+	return { "screen": [ robo.screenWidth, robo.screenHeight ],
+		"width": [ robo.eyeLwidthDefault, robo.eyeRwidthDefault ],
+		"height": [ robo.eyeLheightDefault, robo.eyeRheightDefault ],
+		"radius": [ robo.eyeLborderRadiusDefault, robo.eyeRborderRadiusDefault ],
+		"spacing": robo.spaceBetweenDefault,
+		"cyclops": bool( robo.cyclops ),
+		"frame_interval": robo.frameInterval,
+		"version": VERSION }
+
+def _bbox( kind, args ):
+	# (x0, y0, x1, y1) holding the pixels of a shape, None when not known
+	if kind == "rrect":
+		x, y, w, h = args[:4]
+		if w <= 0 or h <= 0:
+			return None
+		return ( x, y, x + w, y + h )
+	xs = args[0::2]
+	ys = args[1::2]
+	return ( min( xs ), min( ys ), max( xs ) + 1, max( ys ) + 1 )
+
+def _relative( kind, args, x, y ):
+	if kind == "rrect":
+		return ( kind, args[0] - x, args[1] - y ) + tuple( args[2:] )
+	return ( kind, ) + tuple( v - (x if i % 2 == 0 else y) for i, v in enumerate( args ) )
+
+def eye_keys( fg_shapes, bg_shapes ):
+	""" [ (x, y, key) ] per eye (fg shape) of a RoboEyes frame, the key holding the eye and the
+	    bg shapes cutting into it relative to (x, y). None when the eyes can not be told apart:
+	    a bg shape reaching two eyes, or a degenerate shape. """
+	eyes = []
+	for kind, args in fg_shapes:
+		box = _bbox( kind, args )
+		if kind != "rrect" or box is None:
+			return None
+		eyes.append( ( box, [ (kind, args) ] ) )
+	for kind, args in bg_shapes:
+		box = _bbox( kind, args )
+		if box is None:
+			return None
+		hit = [ shapes for eye, shapes in eyes
+			if box[0] < eye[2] and eye[0] < box[2] and box[1] < eye[3] and eye[1] < box[3] ]
+		if len( hit ) > 1:
+			return None
+		if hit:
+			hit[0].append( (kind, args) ) # bg shapes reaching no eye change nothing
+	return [ ( box[0], box[1], tuple( _relative( kind, args, box[0], box[1] ) for kind, args in shapes ) )
+		for box, shapes in eyes ]
+
+def render_tile( key, gfx ):
+	""" (dx, dy, mask) of the eye described by key, relative to the eye; None when empty. """
+	masks = [ getattr( gfx, shape[0] + "_mask" )( *shape[1:] ) for shape in key ]
+	return composite( masks[:1], masks[1:], UNCLIPPED )
+
+
+class EyeAtlas:
+	def __init__( self, path, extra_bytes=2 << 20 ):
+		""" Map the atlas stored at path (without extension). """
+		with open( path + ".json" ) as f:
+			index = json.load( f )
+		self.path = path
+		self.geometry = index["geometry"]
+		self.hits = 0 # eyes found in the atlas
+		self.misses = 0 # eyes composed at runtime
+		self._tiles = {}
+		data = np.memmap( path + ".bin", dtype=np.uint8, mode="r" ) if index["tiles"] else None
+		for key, dx, dy, h, w, offset in index["tiles"]:
+			mask = data[offset:offset + h * w].view( bool ).reshape( h, w )
+			self._tiles[ tuple( tuple( shape ) for shape in key ) ] = ( dx, dy, mask )
+		self._extra = MaskCache( extra_bytes ) # eyes missing from the atlas
+		self._gfx = FBUtil( None, cache_bytes=0 )
+
+	@staticmethod
+	def path_for( directory, geometry ):
+		digest = hashlib.sha1( json.dumps( geometry, sort_keys=True ).encode() ).hexdigest()[:12]
+		return os.path.join( directory, "eyeatlas-" + digest )
+
+	@classmethod
+	def load( cls, directory, robo, build=True, workers=None ):
+		""" The atlas of robo's geometry in directory, built first when missing and build is
+		    True, else None. """
+		path = cls.path_for( directory, geometry( robo ) )
+		if not os.path.exists( path + ".json" ):
+			if not build:
+				return None
+			cls.build( directory, robo, workers )
+		return cls( path )
+
+	@classmethod
+	def build( cls, directory, robo, workers=None ):
+		""" Simulate the animations of robo's geometry, render their eye tiles in parallel and
+		    store them in directory. Returns the path of the atlas. The worker processes are
+		    forked: build before starting threads (a presenter...), not while they run. """
+		geo = geometry( robo )
+		path = cls.path_for( directory, geo )
+		os.makedirs( directory, exist_ok=True )
+		with ProcessPoolExecutor( workers ) as pool:
+			keys = set()
+			for found in pool.map( _simulate, [ (geo, i) for i in range( len( _scripts() ) ) ] ):
+				keys.update( found )
+			keys = sorted( keys )
+			tiles = list( pool.map( _render, keys, chunksize=16 ) )
+		index = []
+		offset = 0
+		for key, tile in zip( keys, tiles ):
+			if tile is None:
+				continue
+			dx, dy, mask = tile
+			index.append( [ key, dx, dy, mask.shape[0], mask.shape[1], offset ] )
+			offset += mask.size
+		# the tiles first, the index last: an atlas with an index is complete
+		data = np.memmap( path + ".bin.tmp", dtype=np.uint8, mode="w+", shape=(max( offset, 1 ),) )
+		for (key, dx, dy, h, w, start), tile in zip( index, [ t for t in tiles if t is not None ] ):
+			data[start:start + h * w] = tile[2].reshape( -1 )
+		data.flush()
+		del data
+		os.replace( path + ".bin.tmp", path + ".bin" )
+		with open( path + ".json.tmp", "w" ) as f:
+			json.dump( { "geometry": geo, "tiles": index }, f )
+		os.replace( path + ".json.tmp", path + ".json" )
+		return path
+
+	def tile( self, key ):
+		""" (dx, dy, mask) of an eye key (see eye_keys()), None for an empty eye. """
+		tile = self._tiles.get( key )
+		if tile is not None:
+			self.hits += 1
+			return tile
+		self.misses += 1
+		return self._extra.get( key, lambda: render_tile( key, self._gfx ) )
+
+	def composite( self, gfx, fg_shapes, bg_shapes, clip ):
+		""" Same as fbutil.composite() of the shapes' masks, the eyes taken from the atlas. """
+		eyes = eye_keys( fg_shapes, bg_shapes )
+		if eyes is None:
+			return composite( [ getattr( gfx, kind + "_mask" )( *args ) for kind, args in fg_shapes ],
+				[ getattr( gfx, kind + "_mask" )( *args ) for kind, args in bg_shapes ], clip )
+		placed = []
+		for x, y, key in eyes:
+			tile = self.tile( key )
+			if tile is not None:
+				placed.append( ( x + tile[0], y + tile[1], tile[2] ) )
+		if len( placed ) == 1:
+			return placed[0] # fb.compose() clips it
+		return composite( placed, [], clip )
+
+	def __len__( self ):
+		return len( self._tiles )
+
+	def __repr__( self ):
+		return "EyeAtlas(%s, tiles=%d, hits=%d, misses=%d)" % ( os.path.basename( self.path ),
+			len( self._tiles ), self.hits, self.misses )
+
+
+# --- Building -----------------------------------------------------------------
+
+def _scripts():
+	# [ (ms, action) ] animations run from a fresh RoboEyes, action called with it
+	from roboeyes import DEFAULT, TIRED, ANGRY, HAPPY, CURIOUS, E, W
+	moods = [ DEFAULT, TIRED, ANGRY, HAPPY ]
+	scripts = []
+	for mood in moods:
+		script = [ (0, lambda robo, mood=mood: robo.set_mood( mood )) ]
+		for action in ( lambda robo: robo.blink(), lambda robo: robo.blink( left=True ), lambda robo: robo.blink( right=True ) ):
+			script.append( (1500, action) )
+		for other in moods:
+			if other != mood:
+				script.append( (1500, lambda robo, other=other: robo.set_mood( other )) )
+				script.append( (1500, lambda robo, mood=mood: robo.set_mood( mood )) )
+		scripts.append( script )
+	for direction in ( E, W ):
+		scripts.append( [ (0, lambda robo: robo.set_mood( CURIOUS )),
+			(0, lambda robo, direction=direction: robo.set_position( direction )),
+			(1500, lambda robo: robo.blink()), (1500, lambda robo: robo.set_mood( DEFAULT )) ] )
+	return scripts
+
+def _simulate( job ):
+	# eye keys of the frames drawn by a script, in a worker process
+	geo, script = job
+	script = _scripts()[script]
+	from display_fbgen import Framebuffer
+	from fbbackend import NullBackend
+	from roboeyes import RoboEyes
+	now = [ 0 ]
+	width, height = geo["screen"]
+	fb = Framebuffer( width, height, pixel_format="RGB565", backend=NullBackend( width, height, 16 ) )
+	robo = RoboEyes( fb, width, height, frame_rate=max( 1, 1000 // geo["frame_interval"] ),
+		on_show=lambda robo: None, clock=lambda: now[0] )
+	robo.eyes_width( *geo["width"] )
+	robo.eyes_height( *geo["height"] )
+	robo.eyes_radius( *geo["radius"] )
+	robo.eyes_spacing( geo["spacing"] )
+	robo.cyclops = geo["cyclops"]
+	keys = set()
+	def collect( fg_shapes, bg_shapes ):
+		for _x, _y, key in eye_keys( fg_shapes, bg_shapes ) or []:
+			keys.add( key )
+	robo.draw_shapes = collect
+	for wait, action in script + [ (1500, None) ]:
+		end = now[0] + wait
+		while now[0] < end:
+			robo.draw_eyes()
+			now[0] += robo.frameInterval
+		if action is not None:
+			action( robo )
+	return keys
+
+_worker_gfx = None
+
+def _render( key ):
+	global _worker_gfx
+	if _worker_gfx is None:
+		_worker_gfx = FBUtil( None, cache_bytes=8 << 20 )
+	return render_tile( key, _worker_gfx )
+
+
+if __name__ == "__main__":
+	# Build the atlas of the default RoboEyes geometry at the frame rate of main.py
+	from display_fbgen import Framebuffer
+	from fbbackend import NullBackend
+	from roboeyes import RoboEyes
+	directory = sys.argv[1] if len( sys.argv ) > 1 else os.path.expanduser( "~/.cache/roboeyes" )
+	fb = Framebuffer( 480, 320, pixel_format="RGB565", backend=NullBackend( 480, 320, 16 ) )
+	robo = RoboEyes( fb, 480, 320, frame_rate=15, on_show=lambda robo: None )
+	path = EyeAtlas.build( directory, robo )
+	print( EyeAtlas( path ) )
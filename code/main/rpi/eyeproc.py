@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+""" RoboEyes in a process of its own.
+
+	Speech recognition or vision holding the GIL for seconds would stall a render thread.
+	EyeProcess runs RoboEyes and its Framebuffer in a separate process, pinned to one CPU
+	core, and drives it through a fixed-layout control block in shared memory:
+
+	eyes = EyeProcess( frame_rate=15, setup=configure ).start()
+	eyes.mood = HAPPY
+	eyes.blink()
+	eyes.look_at( 100, 40 )
+	eyes.start_sequence( 0 )
+	...
+	eyes.stop()
+
+	Setting a value writes its field in the block, framed by a sequence counter that is odd
+	while the block is written (seqlock), and sets an Event waking the renderer up. The
+	renderer copies the block, retries when the counter changed meanwhile, and applies the
+	fields that changed since its last copy right before a frame: no socket, no round trip.
+	One-shot animations (blink, laugh, sequence start...) are counters, several requests
+	between two frames play once. Fields never set leave the eyes as setup() made them.
+
+	With share_frame=True the back buffer the renderer draws in lives in shared memory too:
+	frame() returns a copy of the last complete frame, e.g. for a preview stream.
+
+	setup( robo ) configures the RoboEyes in the renderer (geometry, automated behaviours,
+	sequences, atlas, power saving); it must be a module level function when the process
+	start method is not fork.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Control block, written by EyeProcess only. -1: never set
+CONTROL = np.dtype( [
+	( "seq", "<u4" ), # odd while being written
+	( "stop", "<u4" ),
+	( "mood", "<i4" ),
+	( "position", "<i4" ),
+	( "x", "<i4" ), # look_at() target
+	( "y", "<i4" ),
+	( "targets", "<u4" ), # look_at() count
+	( "autoblinker", "i1" ),
+	( "idle", "i1" ),
+	( "curious", "i1" ),
+	( "cyclops", "i1" ),
+	( "h_flicker", "<i2" ), # amplitude, 0: off
+	( "v_flicker", "<i2" ),
+	( "blinks", "<u4" ), # one-shot animations: counts
+	( "blinks_left", "<u4" ),
+	( "blinks_right", "<u4" ),
+	( "laughs", "<u4" ),
+	( "confusions", "<u4" ),
+	( "wakes", "<u4" ),
+	( "sequence", "<i4" ), # index in robo.sequences
+	( "sequence_starts", "<u4" ),
+] )
+UNSET = { "mood": -1, "position": -1, "x": -1, "y": -1, "autoblinker": -1, "idle": -1,
+	"curious": -1, "cyclops": -1, "h_flicker": -1, "v_flicker": -1, "sequence": -1 }
+
+# Status block, written by the renderer only
+STATUS = np.dtype( [
+	( "seq", "<u4" ), # odd while drawing a frame or writing the status
+	( "frames", "<u4" ), # frames drawn
+	( "control", "<u4" ), # seq of the last control block applied
+	( "asleep", "u1" ),
+] )
+STATUS_OFFSET = 128
+FRAME_OFFSET = 256
+
+
+def _read( block, retries=1000 ):
+	# consistent copy of a seqlock protected block
+	for _ in range( retries ):
+		seq = int( block["seq"][0] )
+		if seq & 1 == 0:
+			copy = block.copy()
+			if int( block["seq"][0] ) == seq:
+				return copy[0]
+		time.sleep( 0 )
+	raise TimeoutError( "shared block stays locked" )
+
+
+class EyeProcess:
+	def __init__( self, frame_rate=15, fb_args=None, setup=None, cpu=None, share_frame=False, context=None ):
+		""" fb_args: display_fbgen.Framebuffer arguments (default: /dev/fb0). cpu: core the
+		    renderer is pinned to, default the last one (none on a single core). """
+		self.frame_rate = frame_rate
+		self.fb_args = fb_args or {}
+		self.setup = setup
+		if cpu is None and ( os.cpu_count() or 1 ) > 1:
+			cpu = os.cpu_count() - 1
+		self.cpu = cpu
+		if share_frame and ( self.fb_args.get( "direct" ) or self.fb_args.get( "page_flip" ) ):
+			# the shared frame replaces the back buffer, which these modes draw on screen through
+			raise ValueError( "share_frame needs a Framebuffer in copy mode (no direct/page_flip)" )
+		self.share_frame = share_frame
+		self._mp = multiprocessing.get_context( context )
+		self._lock = threading.RLock() # threads of this process writing the control block
+		self._shm = None
+		self._frame_shm = None
+		self._frame = None
+		self._process = None
+
+	def start( self, timeout=30 ):
+		""" Start the renderer, returns once it is set up and running. """
+		self._shm = shared_memory.SharedMemory( create=True, size=FRAME_OFFSET )
+		self._control = np.ndarray( (1,), dtype=CONTROL, buffer=self._shm.buf )
+		self._status = np.ndarray( (1,), dtype=STATUS, buffer=self._shm.buf, offset=STATUS_OFFSET )
+		self._control[:] = np.zeros( 1, dtype=CONTROL )
+		for name, value in UNSET.items():
+			self._control[name] = value
+		self._status[:] = np.zeros( 1, dtype=STATUS )
+		self._wakeup = self._mp.Event()
+		ready, child = self._mp.Pipe( duplex=False )
+		self._process = self._mp.Process( target=_serve, name="roboeyes-render", daemon=True,
+			args=( self._shm.name, child, self._wakeup, self.frame_rate, self.fb_args, self.setup, self.cpu, self.share_frame ) )
+		self._process.start()
+		child.close()
+		if not ready.poll( timeout ):
+			self.stop()
+			raise TimeoutError( "the renderer did not start" )
+		reply = ready.recv()
+		if reply[0] == "error":
+			self.stop()
+			raise RuntimeError( "the renderer failed: %s" % reply[1] )
+		if self.share_frame:
+			_kind, name, shape, dtype = reply
+			self._frame_shm = shared_memory.SharedMemory( name=name )
+			self._frame = np.ndarray( shape, dtype=dtype, buffer=self._frame_shm.buf )
+		return self
+
+	def stop( self, timeout=5 ):
+		if self._process is not None:
+			self._write( stop=1 )
+			self._process.join( timeout )
+			if self._process.is_alive():
+				self._process.terminate()
+				self._process.join()
+			self._process = None
+		self._frame = None
+		for shm in ( self._frame_shm, self._shm ):
+			if shm is not None:
+				shm.close()
+				shm.unlink()
+		self._frame_shm = None
+		self._shm = None
+
+	def __enter__( self ):
+		return self.start()
+
+	def __exit__( self, *exc ):
+		self.stop()
+
+	# --- Control -----------------------------------------------
+
+	def _write( self, **fields ):
+		control = self._control
+		with self._lock:
+			control["seq"] += 1 # odd: the renderer waits
+			for name, value in fields.items():
+				control[name] = value
+			control["seq"] += 1
+		self._wakeup.set()
+
+	def _count( self, name, **fields ):
+		with self._lock:
+			self._write( **{ name: int( self._control[name][0] ) + 1 }, **fields )
+
+	@property
+	def mood( self ):
+		return int( self._control["mood"][0] )
+
+	@mood.setter
+	def mood( self, mood ):
+		self._write( mood=mood )
+
+	@property
+	def position( self ):
+		return int( self._control["position"][0] )
+
+	@position.setter
+	def position( self, direction ):
+		self._write( position=direction )
+
+	def look_at( self, x, y ):
+		# Move the left eye to x, y (the right one follows)
+		self._count( "targets", x=x, y=y )
+
+	@property
+	def curious( self ):
+		return bool( self._control["curious"][0] == 1 )
+
+	@curious.setter
+	def curious( self, enable ):
+		self._write( curious=int( bool( enable ) ) )
+
+	@property
+	def cyclops( self ):
+		return bool( self._control["cyclops"][0] == 1 )
+
+	@cyclops.setter
+	def cyclops( self, enable ):
+		self._write( cyclops=int( bool( enable ) ) )
+
+	def set_auto_blinker( self, active ):
+		self._write( autoblinker=int( bool( active ) ) )
+
+	def set_idle_mode( self, active ):
+		self._write( idle=int( bool( active ) ) )
+
+	def horiz_flicker( self, enable, amplitude=2 ):
+		self._write( h_flicker=amplitude if enable else 0 )
+
+	def vert_flicker( self, enable, amplitude=2 ):
+		self._write( v_flicker=amplitude if enable else 0 )
+
+	def blink( self, left=None, right=None ):
+		if left == None and right == None:
+			self._count( "blinks" )
+		if left:
+			self._count( "blinks_left" )
+		if right:
+			self._count( "blinks_right" )
+
+	def laugh( self ):
+		self._count( "laughs" )
+
+	def confuse( self ):
+		self._count( "confusions" )
+
+	def wake( self ):
+		self._count( "wakes" )
+
+	def start_sequence( self, index ):
+		# Play robo.sequences[index] from its first step, as defined by setup()
+		self._count( "sequence_starts", sequence=index )
+
+	# --- Status ------------------------------------------------
+
+	def status( self ):
+		""" { frames drawn, seq of the last control block applied, asleep } """
+		status = _read( self._status )
+		return { "frames": int( status["frames"] ), "control": int( status["control"] ), "asleep": bool( status["asleep"] ) }
+
+	def applied( self ):
+		""" True once the renderer applied everything written so far. """
+		return _read( self._status )["control"] >= int( self._control["seq"][0] )
+
+	def frame( self ):
+		""" Copy of the last frame drawn, None without share_frame. """
+		if self._frame is None:
+			return None
+		for _ in range( 1000 ):
+			seq = int( self._status["seq"][0] )
+			if seq & 1 == 0:
+				copy = self._frame.copy()
+				if int( self._status["seq"][0] ) == seq:
+					return copy
+			time.sleep( 0.001 )
+		raise TimeoutError( "the renderer keeps drawing" )
+
+	def __repr__( self ):
+		if self._process is None:
+			return "EyeProcess(stopped)"
+		return "EyeProcess(pid %d, cpu %s, %r)" % ( self._process.pid, self.cpu, self.status() )
+
+
+# --- Renderer process ------------------------------------------
+
+def _apply( robo, control, last ):
+	def changed( name ):
+		return control[name] != last[name]
+	if changed( "mood" ):
+		robo.mood = int( control["mood"] )
+	if changed( "position" ):
+		robo.position = int( control["position"] )
+	if changed( "targets" ):
+		robo.eyeLxNext = int( control["x"] )
+		robo.eyeLyNext = int( control["y"] )
+		robo.wake()
+	if changed( "autoblinker" ):
+		robo.set_auto_blinker( bool( control["autoblinker"] ) )
+	if changed( "idle" ):
+		robo.set_idle_mode( bool( control["idle"] ) )
+	if changed( "curious" ):
+		robo.curious = bool( control["curious"] )
+	if changed( "cyclops" ):
+		robo.cyclops = bool( control["cyclops"] )
+	if changed( "h_flicker" ):
+		robo.horiz_flicker( control["h_flicker"] > 0, int( control["h_flicker"] ) or None )
+	if changed( "v_flicker" ):
+		robo.vert_flicker( control["v_flicker"] > 0, int( control["v_flicker"] ) or None )
+	if changed( "blinks" ):
+		robo.blink()
+	if changed( "blinks_left" ):
+		robo.blink( left=True )
+	if changed( "blinks_right" ):
+		robo.blink( right=True )
+	if changed( "laughs" ):
+		robo.laugh()
+	if changed( "confusions" ):
+		robo.confuse()
+	if changed( "wakes" ):
+		robo.wake()
+	if changed( "sequence_starts" ):
+		index = int( control["sequence"] )
+		if 0 <= index < len( robo.sequences ):
+			robo.sequences[index].reset() # start() alone does not rewind a sequence that ran
+			robo.sequences[index].start()
+		else:
+			print( "RoboEyes: no sequence", index )
+
+def _serve( name, ready, wakeup, frame_rate, fb_args, setup, cpu, share_frame ):
+	shm = shared_memory.SharedMemory( name=name )
+	frame_shm = None
+	handed = False # the parent got frame_shm: it unlinks it in stop()
+	fb = robo = back = shared = None
+	try:
+		try:
+			if cpu is not None and hasattr( os, "sched_setaffinity" ):
+				os.sched_setaffinity( 0, { cpu } )
+			from display_fbgen import Framebuffer
+			from roboeyes import RoboEyes
+			control = np.ndarray( (1,), dtype=CONTROL, buffer=shm.buf )
+			status = np.ndarray( (1,), dtype=STATUS, buffer=shm.buf, offset=STATUS_OFFSET )
+			fb = Framebuffer( **fb_args )
+			reply = ( "ready", )
+			if share_frame:
+				back = fb.fb
+				frame_shm = shared_memory.SharedMemory( create=True, size=back.nbytes )
+				shared = np.ndarray( back.shape, dtype=back.dtype, buffer=frame_shm.buf )
+				fb.swap_back( shared ) # RoboEyes clears the screen first, nothing to carry
+				reply = ( "ready", frame_shm.name, back.shape, back.dtype.str )
+			robo = RoboEyes( fb, fb.width, fb.height, frame_rate=frame_rate, on_show=lambda robo: fb.update() )
+			if setup is not None:
+				setup( robo )
+		except Exception as e:
+			ready.send( ( "error", repr( e ) ) )
+			return
+		last = np.zeros( 1, dtype=CONTROL )[0]
+		for field, value in UNSET.items():
+			last[field] = value
+		ready.send( reply )
+		handed = True
+		back = shared = None # only the Framebuffer keeps a view on the shared frame
+		while True:
+			wakeup.clear() # before reading: a later write sets it again
+			current = _read( control )
+			if current["stop"]:
+				break
+			status["seq"] += 1 # odd: drawing
+			_apply( robo, current, last )
+			last = current
+			drawn = robo.fpsTimer
+			robo.update()
+			if robo.fpsTimer != drawn:
+				status["frames"] += 1
+			status["control"] = current["seq"]
+			status["asleep"] = robo.asleep
+			status["seq"] += 1
+			wait = robo.next_frame_in()
+			wakeup.wait( None if wait == None else wait / 1000 )
+	finally:
+		ready.close()
+		control = status = None
+		shm.close()
+		if fb is not None:
+			fb.close()
+		robo = fb = back = shared = None # drop the views before closing the mapping
+		if frame_shm is not None:
+			if not handed:
+				frame_shm.unlink()
+			try:
+				frame_shm.close()
+			except BufferError:
+				pass # still referenced, unmapped on exit
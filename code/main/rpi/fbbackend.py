@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+""" Where the pixels of a display_fbgen.Framebuffer end up.
+
+	DeviceBackend maps a Linux framebuffer device (/dev/fbN). FileBackend and MemoryBackend
+	mimic one (geometry, stride and panning included) in a file or in RAM, NullBackend
+	discards every frame. The last three need no display: use them to run and profile
+	RoboEyes on a workstation or in CI.
+"""
+import fcntl
+import mmap
+import os
+import stat
+import struct
+import zlib
+
+import numpy as np
+
+# linux/fb.h
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+FBIOPAN_DISPLAY = 0x4606
+
+
+class FBInfo:
+	""" Geometry of a framebuffer device, as reported by the kernel. """
+	__slots__ = [ "width", "height", "virtual_width", "virtual_height", "bpp", "stride" ]
+
+	def __init__( self, width, height, virtual_width, virtual_height, bpp, stride ):
+		self.width = width # visible resolution
+		self.height = height
+		self.virtual_width = virtual_width # size of the whole mapping, can be larger (panning)
+		self.virtual_height = virtual_height
+		self.bpp = bpp # bits per pixel
+		self.stride = stride # bytes per row (line_length), may include padding
+
+	def __repr__( self ):
+		return "FBInfo(%dx%d, virtual %dx%d, %dbpp, stride %d)" % ( self.width, self.height,
+			self.virtual_width, self.virtual_height, self.bpp, self.stride )
+
+
+def _read_sysfs( path ):
+	with open( path ) as f:
+		return f.read().strip()
+
+def probe_sysfs( fb_path ):
+	""" Read the geometry from /sys/class/graphics/fbN, None when unavailable. """
+	sysdir = os.path.join( "/sys/class/graphics", os.path.basename( os.path.realpath( fb_path ) ) )
+	try:
+		vw, vh = [ int(v) for v in _read_sysfs( os.path.join(sysdir, "virtual_size") ).split(",") ]
+		bpp = int( _read_sysfs( os.path.join(sysdir, "bits_per_pixel") ) )
+		stride = int( _read_sysfs( os.path.join(sysdir, "stride") ) )
+	except (OSError, ValueError):
+		return None
+	# visible resolution from the current mode, e.g. "U:480x320p-0"
+	width, height = vw, vh
+	try:
+		mode = _read_sysfs( os.path.join(sysdir, "mode") ) or _read_sysfs( os.path.join(sysdir, "modes") ).splitlines()[0]
+		width, height = [ int(v) for v in mode.split(":")[1].split("p")[0].split("i")[0].split("x") ]
+	except (OSError, ValueError, IndexError):
+		pass
+	return FBInfo( width, height, vw, vh, bpp, stride )
+
+def probe_ioctl( fb_path ):
+	""" Read the geometry with FBIOGET_VSCREENINFO / FBIOGET_FSCREENINFO, None when unavailable. """
+	try:
+		fd = os.open( fb_path, os.O_RDONLY )
+	except OSError:
+		return None
+	try:
+		var = fcntl.ioctl( fd, FBIOGET_VSCREENINFO, bytes(160) )
+		fix = fcntl.ioctl( fd, FBIOGET_FSCREENINFO, bytes(128) )
+	except OSError:
+		return None
+	finally:
+		os.close( fd )
+	xres, yres, xres_virtual, yres_virtual, _xoffset, _yoffset, bpp = struct.unpack_from( "7I", var )
+	# struct fb_fix_screeninfo: char id[16]; unsigned long smem_start; __u32 smem_len, type,
+	# type_aux, visual; __u16 xpanstep, ypanstep, ywrapstep; __u32 line_length; ...
+	line_length = struct.unpack_from( "@16sLIIIIHHHI", fix )[-1]
+	return FBInfo( xres, yres, xres_virtual, yres_virtual, bpp, line_length )
+
+def probe( fb_path ):
+	""" Geometry of fb_path from sysfs, or the ioctls; None for anything that is not a framebuffer. """
+	return probe_sysfs( fb_path ) or probe_ioctl( fb_path )
+
+
+
+class FBBackend:
+	""" Base class of the backends. The Framebuffer maps pages (screens of
+	    info.stride * info.height bytes) with map(), syncs byte ranges with flush() and
+	    shows a page with pan(). """
+	def __init__( self, info ):
+		self.info = info # FBInfo
+		self.yoffset = 0 # first visible row, changed by pan()
+
+	def map( self, pages ):
+		""" Writable buffer of `pages` screens, None when the backend keeps nothing. """
+		raise NotImplementedError
+
+	def flush( self, offset, size ):
+		""" Make the byte range visible on the display. """
+		pass
+
+	def pan( self, page ):
+		""" Show the given page. Raises OSError when not supported. """
+		if (page + 1) * self.info.height > self.info.virtual_height:
+			raise OSError( "page %d is outside the virtual screen" % page )
+		self.yoffset = page * self.info.height
+
+	def close( self ):
+		pass
+
+	def __repr__( self ):
+		return "%s(%r)" % ( self.__class__.__name__, self.info )
+
+
+class DeviceBackend( FBBackend ):
+	""" A Linux framebuffer device. The geometry is probed; width, height and bpp are only
+	    used when probing fails. """
+	def __init__( self, fb_path='/dev/fb0', width=480, height=320, bpp=32 ):
+		info = probe( fb_path ) or FBInfo( width, height, width, height, bpp, width * bpp // 8 )
+		super().__init__( info )
+		self.fb_path = fb_path
+		self._fd = None
+		self._mmap = None
+		self._var = None # fb_var_screeninfo used for panning
+
+	def _open( self ):
+		if self._fd is None:
+			self._fd = os.open( self.fb_path, os.O_RDWR )
+		return self._fd
+
+	def map( self, pages ):
+		self._mmap = mmap.mmap( self._open(), self.info.stride * self.info.height * pages,
+			mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE )
+		return self._mmap
+
+	def flush( self, offset, size ):
+		self._mmap.flush( offset, size )
+
+	def pan( self, page ):
+		if self._var is None:
+			self._var = bytearray( fcntl.ioctl( self._open(), FBIOGET_VSCREENINFO, bytes(160) ) )
+		struct.pack_into( "I", self._var, 20, page * self.info.height ) # yoffset
+		fcntl.ioctl( self._fd, FBIOPAN_DISPLAY, self._var )
+		self.yoffset = page * self.info.height
+
+	def close( self ):
+		if self._fd is not None:
+			os.close( self._fd )
+			self._fd = None
+
+
+class FileBackend( FBBackend ):
+	""" A file laid out like /dev/fb0 (rows of `stride` bytes, `virtual_height` rows), e.g. to
+	    inspect frames afterwards. Panning only records yoffset. """
+	def __init__( self, path, width=480, height=320, bpp=32, stride=None, virtual_height=None ):
+		stride = stride or width * bpp // 8
+		super().__init__( FBInfo( width, height, width, virtual_height or height, bpp, stride ) )
+		self.path = path
+		self._mmap = None
+
+	def map( self, pages ):
+		size = self.info.stride * self.info.height * pages
+		fd = os.open( self.path, os.O_RDWR | os.O_CREAT )
+		try:
+			if stat.S_ISREG( os.fstat(fd).st_mode ) and os.fstat(fd).st_size < size:
+				os.ftruncate( fd, size )
+			self._mmap = mmap.mmap( fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE )
+		finally:
+			os.close( fd )
+		return self._mmap
+
+	def flush( self, offset, size ):
+		self._mmap.flush( offset, size )
+
+
+class MemoryBackend( FBBackend ):
+	""" A framebuffer in RAM, self.buffer holds what was presented. """
+	def __init__( self, width=480, height=320, bpp=32, stride=None, virtual_height=None ):
+		stride = stride or width * bpp // 8
+		super().__init__( FBInfo( width, height, width, virtual_height or height, bpp, stride ) )
+		self.buffer = None
+
+	def map( self, pages ):
+		self.buffer = bytearray( self.info.stride * self.info.height * pages )
+		return self.buffer
+
+
+class NullBackend( FBBackend ):
+	""" Discards every frame: measures drawing without any presentation cost. """
+	def __init__( self, width=480, height=320, bpp=32 ):
+		super().__init__( FBInfo( width, height, width, height, bpp, width * bpp // 8 ) )
+
+	def map( self, pages ):
+		return None
+
+	def pan( self, page ):
+		raise OSError( "nothing to pan" )
+
+
+def open_backend( fb_path, width=None, height=None, bpp=None ):
+	""" DeviceBackend for a character device, FileBackend (480x320x32 unless given) otherwise. """
+	try:
+		is_device = stat.S_ISCHR( os.stat(fb_path).st_mode )
+	except OSError:
+		is_device = False
+	if is_device:
+		return DeviceBackend( fb_path, width or 480, height or 320, bpp or 32 )
+	return FileBackend( fb_path, width or 480, height or 320, bpp or 32 )
+
+
+# --- Snapshots ---------------------------------------
+
+def write_ppm( path, rgb ):
+	""" Write a (H, W, 3) uint8 RGB array as a binary PPM. """
+	with open( path, "wb" ) as f:
+		f.write( b"P6 %d %d 255\n" % (rgb.shape[1], rgb.shape[0]) )
+		f.write( np.ascontiguousarray( rgb ).tobytes() )
+
+def write_png( path, rgb ):
+	""" Write a (H, W, 3) uint8 RGB array as a PNG (no dependency beyond zlib). """
+	def chunk( tag, data ):
+		return struct.pack( ">I", len(data) ) + tag + data + struct.pack( ">I", zlib.crc32(tag + data) )
+	height, width = rgb.shape[:2]
+	# every row starts with filter type 0 (none)
+	raw = np.zeros( (height, width * 3 + 1), dtype=np.uint8 )
+	raw[:, 1:] = rgb.reshape( height, width * 3 )
+	with open( path, "wb" ) as f:
+		f.write( b"\x89PNG\r\n\x1a\n" )
+		f.write( chunk( b"IHDR", struct.pack( ">IIBBBBB", width, height, 8, 2, 0, 0, 0 ) ) )
+		f.write( chunk( b"IDAT", zlib.compress( raw.tobytes(), 6 ) ) )
+		f.write( chunk( b"IEND", b"" ) )
+
+def write_image( path, rgb ):
+	""" PNG or PPM depending on the extension of path. """
+	if path.lower().endswith( ".png" ):
+		write_png( path, rgb )
+	else:
+		write_ppm( path, rgb )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+""" Presenter thread for display_fbgen.Framebuffer.
+
+	The renderer draws into the Framebuffer as usual and calls submit() instead of update().
+	submit() only swaps buffers: the finished frame is handed over to a thread that does the
+	device write, and drawing continues in a free buffer. When the panel falls behind, a frame
+	that is still waiting when the next one arrives is dropped (latest frame wins) and its
+	damage merged into the newer one. The renderer never waits on display I/O.
+
+	lcd = Framebuffer()
+	presenter = Presenter( lcd ).start()
+	robo = RoboEyes( lcd, 480, 320, on_show=lambda robo: presenter.submit() )
+"""
+import threading
+
+import numpy as np
+
+from display_fbgen import merge_rects
+
+def _merge( a, b ):
+	# union of two damage lists, None (unknown) wins
+	if a is None or b is None:
+		return None
+	return merge_rects( a + b )
+
+
+class Presenter:
+	def __init__( self, fb, buffers=3 ):
+		if fb.direct or fb.page_flip:
+			raise ValueError( "the presenter needs a Framebuffer in copy mode (no direct/page_flip)" )
+		self.fb = fb
+		self.submitted = 0 # frames handed over by the renderer
+		self.presented = 0 # frames written to the device
+		self.dropped = 0 # frames replaced by a newer one before being written
+
+		back = fb.fb
+		# one buffer drawn into, one waiting and one being written; more only adds latency
+		self._free = [ np.empty_like( back ) for _ in range( buffers - 1 ) ]
+		# rows each buffer but the one drawn into misses compared to the latest submitted
+		# frame (None: all of them)
+		self._stale = { id(buf): None for buf in self._free }
+		self._pending = None # (buffer, damage since the last presented frame)
+		self._cond = threading.Condition()
+		self._thread = None
+		self._running = False
+
+	def start( self ):
+		self._running = True
+		self._thread = threading.Thread( target=self._run, name="fb-presenter", daemon=True )
+		self._thread.start()
+		return self
+
+	def stop( self ):
+		""" Write the waiting frame, if any, then stop the thread. """
+		with self._cond:
+			self._running = False
+			self._cond.notify()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def __enter__( self ):
+		return self.start()
+
+	def __exit__( self, *exc ):
+		self.stop()
+
+	def submit( self ):
+		""" Hand the frame drawn in fb over to the presenter thread. Returns immediately. """
+		damage = self.fb.dirty_rects()
+		with self._cond:
+			# every idle buffer now also misses what this frame changed
+			for key in self._stale:
+				self._stale[key] = _merge( self._stale[key], damage )
+			if self._pending is not None:
+				# the panel is behind: the waiting frame is never shown, its damage moves on
+				old, old_damage = self._pending
+				damage = _merge( old_damage, damage )
+				self._free.append( old )
+				self._pending = None
+				self.dropped += 1
+			back = self._free.pop()
+			carry = self._stale.pop( id(back) )
+			if carry is None:
+				carry = [ (0, 0, self.fb.width, self.fb.height) ]
+			# the next frame is drawn over a copy of this one, made lazily by the Framebuffer
+			frame, _ = self.fb.swap_back( back, carry )
+			self._stale[ id(frame) ] = []
+			self._pending = ( frame, damage )
+			self.submitted += 1
+			self._cond.notify()
+
+	def _run( self ):
+		while True:
+			with self._cond:
+				while self._pending is None and self._running:
+					self._cond.wait()
+				if self._pending is None:
+					return
+				frame, damage = self._pending
+				self._pending = None
+			self.fb.present( frame, damage )
+			with self._cond:
+				self.presented += 1
+				self._free.append( frame )
+
+	def __repr__( self ):
+		return "Presenter(submitted=%d, presented=%d, dropped=%d)" % ( self.submitted, self.presented, self.dropped )
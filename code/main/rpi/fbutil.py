@@ -10,52 +10,379 @@
 __version__ = '0.1.0'
 
 import math
+from collections import OrderedDict
+
+import numpy as np
+
+# Sine and cosine of every degree, computed once at import. Arcs run up to startangle+degrees,
+# two turns are tabulated so sin(370) stays sin(math.radians(370)) and not sin(10).
+_TURNS = 720
+_SIN = [ math.sin( math.radians(d) ) for d in range(_TURNS) ]
+_COS = [ math.cos( math.radians(d) ) for d in range(_TURNS) ]
+
+# Per radius offsets of the perimeter points, radius*sin and -radius*cos for each degree.
+# They stay floats, int(x+offset) then truncates exactly like the trig version did.
+# RoboEyes only uses a handful of radii, the cache is dropped when it grows past that.
+_PERI_CACHE_SIZE = 64
+_peri_x_cache = {}
+_peri_y_cache = {}
+
+def _peri_x_offsets( radius ):
+	offsets = _peri_x_cache.get( radius )
+	if offsets is None:
+		if len( _peri_x_cache ) >= _PERI_CACHE_SIZE:
+			_peri_x_cache.clear()
+		offsets = [ radius*s for s in _SIN ]
+		_peri_x_cache[radius] = offsets
+	return offsets
+
+def _peri_y_offsets( radius ):
+	offsets = _peri_y_cache.get( radius )
+	if offsets is None:
+		if len( _peri_y_cache ) >= _PERI_CACHE_SIZE:
+			_peri_y_cache.clear()
+		offsets = [ -radius*c for c in _COS ]
+		_peri_y_cache[radius] = offsets
+	return offsets
+
+# Span rasterizer: the filled shapes are computed as arrays of spans and turned into one boolean
+# mask, drawn with a single fb.fill_mask() call instead of a vline/hline call per column/row.
+# The spans reproduce the line based routines below pixel for pixel.
+
+def _corner_columns( r ):
+	""" (dx, half) of the vertical lines fill_circle_helper() draws for a corner of radius r,
+	    each line spans y0-half .. y0+half+delta. The helper can draw a column twice, the lines
+	    share a center so only the longest one is kept. """
+	halves = {}
+	f = 1 - r
+	ddF_x = 1
+	ddF_y = -2 * r
+	x = 0
+	y = r
+	px = x
+	py = y
+	while x < y:
+		if f >= 0:
+			y -= 1
+			ddF_y += 2
+			f += ddF_y
+		x += 1
+		ddF_x += 2
+		f += ddF_x
+		if x < (y + 1) and halves.get( x, -1 ) < y:
+			halves[x] = y
+		if y != py:
+			if halves.get( py, -1 ) < px:
+				halves[py] = px
+			py = y
+		px = x
+	return list( halves.items() )
+
+def rrect_spans( x, y, width, height, radius ):
+	""" Column spans (xs, y0s, y1s) of fill_rrect(), y1 exclusive, one per column. """
+	max_r = (width if width < height else height) // 2
+	if max_r < radius:
+		radius = max_r
+	xs = [ np.arange( x+radius, x+width-radius ) ]
+	y0s = [ np.full( len( xs[0] ), y ) ]
+	y1s = [ np.full( len( xs[0] ), y+height ) ]
+	corners = _corner_columns( radius )
+	if corners:
+		dx, half = np.array( corners ).T
+		delta = height - 2*radius
+		top = y + radius - half
+		bottom = top + 2*half + delta
+		xs += [ x+width-radius-1 + dx, x+radius - dx ]
+		y0s += [ top, top ]
+		y1s += [ bottom, bottom ]
+	return np.concatenate( xs ), np.concatenate( y0s ), np.concatenate( y1s )
+
+def triangle_spans( x0, y0, x1, y1, x2, y2 ):
+	""" Row spans (ys, x0s, x1s) of fill_triangle(), x1 exclusive, one per row. """
+	if y0 > y1:
+		y0, y1 = y1, y0
+		x0, x1 = x1, x0
+	if y1 > y2:
+		y2, y1 = y1, y2
+		x2, x1 = x1, x2
+	if y0 > y1:
+		y0, y1 = y1, y0
+		x0, x1 = x1, x0
+	if y0 == y2:
+		a = min( x0, x1, x2 )
+		b = max( x0, x1, x2 )
+		return np.array( [y0] ), np.array( [a] ), np.array( [b+1] )
+	dy01 = (y1 - y0) or 1
+	dy02 = (y2 - y0) or 1
+	dy12 = (y2 - y1) or 1
+	last = y1 - 1 if y0 == y1 else y1
+	ys = np.arange( y0, y2+1 )
+	upper = ys[:last-y0+1]
+	lower = ys[last-y0+1:]
+	a = np.concatenate( (x0 + (x1-x0)*(upper-y0) // dy01, x1 + (x2-x1)*(lower-y1) // dy12) )
+	b = x0 + (x2-x0)*(ys-y0) // dy02
+	return ys, np.minimum( a, b ), np.maximum( a, b ) + 1
+
+def _offset_dtype( width, height ):
+	# offsets inside the mask, compared in the narrowest type: int16 compares are several
+	# times faster than int64 ones
+	return np.int16 if width < 0x8000 and height < 0x8000 else np.int32
+
+def column_mask( xs, y0s, y1s ):
+	""" (x, y, mask) covering column spans given at most one per column, None when they are all
+	    empty. """
+	keep = y1s > y0s
+	if not keep.all():
+		xs, y0s, y1s = xs[keep], y0s[keep], y1s[keep]
+	if not len( xs ):
+		return None
+	x = int( xs.min() )
+	y = int( y0s.min() )
+	width = int( xs.max() ) - x + 1
+	height = int( y1s.max() ) - y
+	dtype = _offset_dtype( width, height )
+	top = np.full( width, height, dtype=dtype )
+	bottom = np.zeros( width, dtype=dtype )
+	top[xs - x] = y0s - y
+	bottom[xs - x] = y1s - y
+	rows = np.arange( height, dtype=dtype )[:, None]
+	return x, y, (rows >= top) & (rows < bottom)
+
+def row_mask( ys, x0s, x1s ):
+	""" (x, y, mask) covering row spans given one per row in increasing order, None when they
+	    are all empty. """
+	if not len( ys ) or not (x1s > x0s).any():
+		return None
+	x = int( x0s.min() )
+	width = int( x1s.max() ) - x
+	dtype = _offset_dtype( width, len( ys ) )
+	cols = np.arange( width, dtype=dtype )
+	return x, int( ys[0] ), (cols >= (x0s - x).astype( dtype )[:, None]) & (cols < (x1s - x).astype( dtype )[:, None])
+
+def _ellipse_quadrant( a, b ):
+	""" Outline points (x, y), x and y >= 0, of the ellipse x²/a² + y²/b² = 1 in one quadrant,
+	    traced with the integer midpoint algorithm (a == b gives a midpoint circle). Each row and
+	    column is hit without gaps, the points are 8-connected. """
+	if a <= 0 or b <= 0: # degenerate, a line along the other axis
+		return [ (x, 0) for x in range( a+1 ) ] if b == 0 else [ (0, y) for y in range( b+1 ) ]
+	points = []
+	a2 = a * a
+	b2 = b * b
+	x = 0
+	y = b
+	# region 1, slope above -1: step x, decision at the midpoint (x+1, y-1/2), scaled by 4
+	d = 4*b2 - 4*a2*b + a2
+	while b2*x <= a2*y:
+		points.append( (x, y) )
+		if d >= 0:
+			d += 4*a2*(2 - 2*y)
+			y -= 1
+		d += 4*b2*(2*x + 3)
+		x += 1
+	# region 2: step y, decision at the midpoint (x+1/2, y-1)
+	d = b2*(2*x + 1)**2 + 4*a2*(y - 1)**2 - 4*a2*b2
+	while y >= 0:
+		points.append( (x, y) )
+		if d <= 0:
+			d += 4*b2*(2*x + 2)
+			x += 1
+		d += 4*a2*(3 - 2*y)
+		y -= 1
+	return points
+
+def _arc( xs, ys, a, b, degrees, startangle ):
+	""" Which of the points (relative to the center) lie on the arc of the given degrees starting
+	    at startangle, angles running clockwise from 12 o'clock like the parametric
+	    (a*sin(t), -b*cos(t)) the trig routines used. """
+	if degrees >= 360:
+		return None
+	t = np.degrees( np.arctan2( xs*max( b, 1 ), -ys*max( a, 1 ) ) ) % 360
+	return (t - startangle) % 360 < degrees
+
+def ellipse_outline( a, b, border=1, degrees=360, startangle=0 ):
+	""" (dx, dy, mask) of an ellipse outline around the center, None when empty. A border above 1
+	    is a filled annulus from the outline inwards, border pixels thick. """
+	if a < 0 or b < 0 or degrees <= 0:
+		return None
+	quadrant = np.array( _ellipse_quadrant( a, b ) )
+	if border <= 1:
+		qx, qy = quadrant.T
+		xs = np.concatenate( (qx, -qx, qx, -qx) )
+		ys = np.concatenate( (-qy, -qy, qy, qy) )
+		keep = _arc( xs, ys, a, b, degrees, startangle )
+		if keep is not None:
+			xs, ys = xs[keep], ys[keep]
+		mask = np.zeros( (2*b+1, 2*a+1), dtype=bool )
+		mask[ys + b, xs + a] = True
+		return -a, -b, mask
+	# half width of every row of the filled ellipse, then the inner one cut out
+	outer = np.zeros( b+1, dtype=np.int16 )
+	np.maximum.at( outer, quadrant[:, 1], quadrant[:, 0] )
+	inner = np.full( b+1, -1, dtype=np.int16 )
+	if a >= border and b >= border:
+		quadrant = np.array( _ellipse_quadrant( a-border, b-border ) )
+		np.maximum.at( inner, quadrant[:, 1], quadrant[:, 0] )
+	rows = np.abs( np.arange( -b, b+1, dtype=np.int16 ) )[:, None]
+	cols = np.abs( np.arange( -a, a+1, dtype=np.int16 ) )
+	mask = (cols <= outer[rows]) & (cols > inner[rows])
+	keep = _arc( np.arange( -a, a+1 ), np.arange( -b, b+1 )[:, None], a, b, degrees, startangle )
+	if keep is not None:
+		mask &= keep
+	return -a, -b, mask
+
+def rrect_outline( width, height, radius ):
+	""" (dx, dy, mask) of the outline of the rounded rectangle fill_rrect() fills, corners traced
+	    with the midpoint circle around the same centers. None when empty. """
+	max_r = (width if width < height else height) // 2
+	if max_r < radius:
+		radius = max_r
+	if width <= 0 or height <= 0:
+		return None
+	mask = np.zeros( (height, width), dtype=bool )
+	mask[0, radius:width-radius] = mask[height-1, radius:width-radius] = True
+	mask[radius:height-radius, 0] = mask[radius:height-radius, width-1] = True
+	if radius > 0:
+		qx, qy = np.array( _ellipse_quadrant( radius, radius ) ).T
+		left, right = radius - qx, width-radius-1 + qx
+		top, bottom = radius - qy, height-radius-1 + qy
+		mask[top, left] = mask[top, right] = mask[bottom, left] = mask[bottom, right] = True
+	return 0, 0, mask
+
+def composite( fg, bg, clip ):
+	""" (x, y, mask) of the pixels covered by any of the fg shapes and by none of the bg shapes,
+	    i.e. what stays in the foreground color when the fg shapes are filled first and the bg
+	    shapes over them. Shapes are (x, y, mask) or None, clip is the (x0, y0, x1, y1) screen
+	    area. None when nothing is left. """
+	fg = [ shape for shape in fg if shape is not None ]
+	if not fg:
+		return None
+	x0 = max( clip[0], min( x for x, _y, _m in fg ) )
+	y0 = max( clip[1], min( y for _x, y, _m in fg ) )
+	x1 = min( clip[2], max( x + m.shape[1] for x, _y, m in fg ) )
+	y1 = min( clip[3], max( y + m.shape[0] for _x, y, m in fg ) )
+	if x0 >= x1 or y0 >= y1:
+		return None
+	canvas = np.zeros( (y1-y0, x1-x0), dtype=bool )
+	for shapes, covered in ((fg, True), (bg, False)):
+		for shape in shapes:
+			if shape is None:
+				continue
+			x, y, mask = shape
+			sx0 = max( x, x0 )
+			sy0 = max( y, y0 )
+			sx1 = min( x + mask.shape[1], x1 )
+			sy1 = min( y + mask.shape[0], y1 )
+			if sx0 >= sx1 or sy0 >= sy1:
+				continue
+			part = mask[sy0-y:sy1-y, sx0-x:sx1-x]
+			region = canvas[sy0-y0:sy1-y0, sx0-x0:sx1-x0]
+			if covered:
+				region |= part
+			else:
+				region &= ~part
+	return x0, y0, canvas
+
+
+class MaskCache:
+	""" Least recently used cache of rasterized shape masks, bounded by the bytes the masks use.
+	    Keys describe a shape up to translation, e.g. ("rrect", w, h, r); values are
+	    (dx, dy, mask) with the mask's top left corner relative to the shape's origin. """
+	def __init__( self, max_bytes=4 << 20 ):
+		self.max_bytes = max_bytes # 0 disables caching
+		self.bytes = 0 # bytes held by the cached masks
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+
+	def get( self, key, rasterize ):
+		""" The entry for key, calling rasterize() to build it on a miss. rasterize() returns
+		    (dx, dy, mask) or None for a shape without pixels. """
+		entry = self._entries.get( key )
+		if entry is not None:
+			self._entries.move_to_end( key )
+			self.hits += 1
+			return entry
+		self.misses += 1
+		entry = rasterize()
+		if entry is None:
+			return None
+		size = entry[2].nbytes
+		if size > self.max_bytes:
+			return entry # never fits, don't flush the cache for it
+		entry[2].flags.writeable = False
+		while self.bytes + size > self.max_bytes:
+			_key, old = self._entries.popitem( last=False )
+			self.bytes -= old[2].nbytes
+			self.evictions += 1
+		self._entries[key] = entry
+		self.bytes += size
+		return entry
+
+	def clear( self ):
+		self._entries.clear()
+		self.bytes = 0
+
+	def __len__( self ):
+		return len( self._entries )
+
+	def __repr__( self ):
+		return "MaskCache(entries=%d, bytes=%d, max_bytes=%d, hits=%d, misses=%d, evictions=%d)" % (
+			len( self._entries ), self.bytes, self.max_bytes, self.hits, self.misses, self.evictions )
+
 
 class FBUtil:
-	def __init__(self, fb ):
+	def __init__(self, fb, cache_bytes=4 << 20 ):
 		self.fb = fb
+		# masks of the filled shapes, reused while the eye geometry stays the same
+		self.cache = MaskCache( cache_bytes )
 
 	def _peri_x(self, x, degrees, radius):
-		sin = math.sin(math.radians(degrees))
-		x = int(x+(radius*sin))
-		return x
+		return int(x + _peri_x_offsets(radius)[degrees % _TURNS])
 
 	def _peri_y(self, y, degrees, radius):
-		cos = math.cos(math.radians(degrees))
-		y = int(y-(radius*cos))
-		return y
+		return int(y + _peri_y_offsets(radius)[degrees % _TURNS])
+
+	def _record( self, name, args, color ):
+		# While the framebuffer records a display list the shape is appended to it as one
+		# operation instead of being drawn. True when recorded.
+		recording = getattr( self.fb, "recording", None )
+		if recording is None:
+			return False
+		recording.record( name, args, color )
+		return True
+
+	def _draw_mask( self, x, y, shape, color ):
+		# shape is a cached (dx, dy, mask) relative to (x, y)
+		if shape is None:
+			return
+		if hasattr( self.fb, "fill_mask" ):
+			self.fb.fill_mask( x + shape[0], y + shape[1], shape[2], color )
+			return
+		for Y, X in zip( *np.nonzero( shape[2] ) ):
+			self.fb.pixel( x + shape[0] + int(X), y + shape[1] + int(Y), color )
 
 	def fill(self,bgcolor ):
 		self.fb.fill_screen( bgcolor )
 
 	def circle( self, x, y, radius, color, border=1, degrees=360, startangle=0):
-		border = 5 if border > 5 else border
-		# adding startangle to degrees
-		if startangle > 0:
-			degrees += startangle
-		if border > 1:
-			x = x - border//2
-			y = y - border//2
-			radius = radius-border//2
-		for i in range(startangle, degrees):
-			X = self._peri_x(x, i, radius)
-			Y = self._peri_y(y, i, radius)
-			if   i == 90:  X = X-1
-			elif i == 180: Y = Y-1
-			if border==1:
-				self.fb.pixel( X,Y, color )
-			else:
-				self.fb.rect(X, Y, border, border, color )
+		if self._record( "circle", (x, y, radius, border, degrees, startangle), color ):
+			return
+		self.oval( x, y, radius, radius, color, border, degrees, startangle )
 
 	def fill_circle(self, x, y, radius, color):
 		tempY = 0
+		neg_x = _peri_x_offsets(radius-1)
+		pos_x = _peri_x_offsets(radius)
+		upper_y = _peri_y_offsets(radius+1)
+		lower_y = _peri_y_offsets(radius-1)
 		for i in range(180):
-			xNeg = self._peri_x(x, 360-i, radius-1)
-			xPos = self._peri_x(x, i, radius)
+			xNeg = int(x + neg_x[360-i])
+			xPos = int(x + pos_x[i])
 			if i > 89:
-				Y = self._peri_y(y, i, radius-1)
+				Y = int(y + lower_y[i])
 			else:
-				Y = self._peri_y(y, i, radius+1)
+				Y = int(y + upper_y[i])
 			if i == 90: xPos = xPos-1
 			if tempY != Y and tempY > 0:
 				length = xPos+1
@@ -107,31 +434,23 @@ class FBUtil:
 
 
 	def oval( self, x, y, xradius, yradius, color, border=1, degrees=360, startangle=0):
-		border = 5 if border > 5 else border
-		# adding startangle to degrees
-		if startangle > 0:
-			degrees += startangle
-		if border > 1:
-			x = x - border//2
-			y = y - border//2
-			xradius = xradius-border//2
-			yradius = yradius-border//2
-		for i in range(startangle, degrees):
-			X = self._peri_x(x, i, xradius)
-			Y = self._peri_y(y, i, yradius)
-			if   i == 90:  X = X-1
-			elif i == 180: Y = Y-1
-			if border==1:
-				self.fb.pixel( X,Y, color )
-			else:
-				self.fb.rect(X, Y, border, border, color )
+		""" Outline of an ellipse centered on (x, y), optionally only the arc of the given degrees
+		    clockwise from startangle (0 is 12 o'clock). A border above 1 draws a ring that many
+		    pixels thick inside the outline. """
+		if self._record( "oval", (x, y, xradius, yradius, border, degrees, startangle), color ):
+			return
+		shape = self.cache.get( ("oval", xradius, yradius, border, degrees, startangle % 360),
+			lambda: ellipse_outline( xradius, yradius, border, degrees, startangle % 360 ) )
+		self._draw_mask( x, y, shape, color )
 
 	def fill_oval( self, x, y, xradius, yradius, color ):
 		tempY = 0
+		px = _peri_x_offsets(xradius)
+		py = _peri_y_offsets(yradius)
 		for i in range(180):
-			xNeg = self._peri_x(x, 360-i, xradius)
-			xPos = self._peri_x(x, i, xradius)
-			Y	= self._peri_y(y, i, yradius)
+			xNeg = int(x + px[360-i])
+			xPos = int(x + px[i])
+			Y	= int(y + py[i])
 
 			if i > 89: Y = Y-1
 			if tempY != Y and tempY > 0:
@@ -140,21 +459,38 @@ class FBUtil:
 			tempY = Y
 
 	def rrect( self, x,y, width, height, radius, color ):
-		#assert (2*radius) < height
-		#assert (2*radius) < width
-		max_r = (w if w<h else h)//2
-		if max_r < radius:
-			radius = max_r
-		self.circle( x+radius, y+radius, radius, color, border=1, degrees=90, startangle=270)
-		self.fb.hline( x+radius, y, width-(2*radius), color )
-		self.circle( x+width-radius, y+radius, radius, color, border=1, degrees=90, startangle=0)
-		self.fb.vline( x+width-1, y+radius, height-(2*radius), color )
-		self.circle( x+width-radius, y+height-radius, radius, color, border=1, degrees=90, startangle=90)
-		self.fb.hline( x+radius+1, y+height, width-(2*radius), color )
-		self.circle( x+radius, y+height-radius, radius, color, border=1, degrees=90, startangle=180)
-		self.fb.vline( x, y+radius+1, height-(2*radius)-1, color )
+		""" Outline of the rounded rectangle fill_rrect() fills. """
+		if self._record( "rrect", (x, y, width, height, radius), color ):
+			return
+		shape = self.cache.get( ("rrect outline", width, height, radius),
+			lambda: rrect_outline( width, height, radius ) )
+		self._draw_mask( x, y, shape, color )
+
+	def rrect_mask( self, x,y, width, height, radius ):
+		""" (x, y, mask) of the pixels fill_rrect() fills, None when there are none. """
+		shape = self.cache.get( ("rrect", width, height, radius),
+			lambda: column_mask( *rrect_spans( 0, 0, width, height, radius ) ) )
+		if shape is None:
+			return None
+		return x + shape[0], y + shape[1], shape[2]
+
+	def triangle_mask( self, x0, y0, x1, y1, x2, y2 ):
+		""" (x, y, mask) of the pixels fill_triangle() fills. """
+		# the spans only depend on the vertices relative to each other
+		shape = self.cache.get( ("triangle", x1-x0, y1-y0, x2-x0, y2-y0),
+			lambda: row_mask( *triangle_spans( 0, 0, x1-x0, y1-y0, x2-x0, y2-y0 ) ) )
+		if shape is None:
+			return None
+		return x0 + shape[0], y0 + shape[1], shape[2]
 
 	def fill_rrect( self, x,y, width, height, radius, color ):
+		if self._record( "fill_rrect", (x, y, width, height, radius), color ):
+			return
+		if hasattr( self.fb, "fill_mask" ):
+			shape = self.rrect_mask( x, y, width, height, radius )
+			if shape is not None:
+				self.fb.fill_mask( shape[0], shape[1], shape[2], color )
+			return
 		max_r = (width if width < height else height) // 2
 		if max_r < radius:
 			radius = max_r
@@ -164,6 +500,13 @@ class FBUtil:
 
 	def fill_triangle(self, x0, y0, x1, y1, x2, y2, c ):
 		""" Triangle drawing function.  Will draw a single pixel wide triangle around the points (x0, y0), (x1, y1), and (x2, y2), colour c """
+		if self._record( "fill_triangle", (x0, y0, x1, y1, x2, y2), c ):
+			return
+		if hasattr( self.fb, "fill_mask" ):
+			shape = self.triangle_mask( x0, y0, x1, y1, x2, y2 )
+			if shape is not None:
+				self.fb.fill_mask( shape[0], shape[1], shape[2], c )
+			return
 		if y0 > y1:
 			y0, y1 = y1, y0
 			x0, x1 = x1, x0
@@ -1,9 +1,13 @@
+import asyncio
+import os
 import serial
 import time
 
 from roboeyes import *
 import time
 from display_fbgen import Framebuffer
+from fbpresenter import Presenter
+from backlight import Backlight
 
 
 start_timer_val = time.perf_counter()  # high-precision timer 
@@ -12,13 +16,16 @@ def ticks_ms():
 	return (time.perf_counter() - start_timer_val) * 1000
 
 lcd = Framebuffer()
+# Device writes happen on the presenter thread, a slow SPI flush no longer stalls this loop.
+# The thread starts once the eye atlas is loaded (submitted frames wait for it until then)
+presenter = Presenter( lcd )
 
 # Start the display
 lcd.fill(1)
 time.sleep(1)
 
 
-fps_screen = 7
+fps_screen = 15 # while the eyes move, the governor drops to 2 fps once they stand still
 
 # Open the serial port (adjust as needed)
 ser = serial.Serial(port='/dev/ttyS0', baudrate=9600, timeout=1)  # Use '/dev/ttyUSB0' on Linux
@@ -26,7 +33,7 @@ ser = serial.Serial(port='/dev/ttyS0', baudrate=9600, timeout=1)  # Use '/dev/tt
 
 # RoboEyes callback event
 def robo_show( roboeyes ):
-	lcd.update()
+	presenter.submit()
 
 # Plug RoboEyes on any FrameBuffer descendant
 robo = RoboEyes( lcd, 480, 320, frame_rate=fps_screen, on_show = robo_show )
@@ -34,6 +41,7 @@ robo = RoboEyes( lcd, 480, 320, frame_rate=fps_screen, on_show = robo_show )
 # Define some automated eyes behaviour
 robo.set_auto_blinker( ON, 4, 2) # Start auto blinker animation cycle -> bool active, int interval, int variation -> turn on/off, set interval between each blink in full seconds, set range for random interval variation in full seconds
 robo.set_idle_mode( ON, 5, 2) # Start idle animation cycle (eyes looking in random directions) -> turn on/off, set interval between each eye repositioning in full seconds, set range for random time interval variation in full seconds
+robo.set_power_saving( ON, 2, 5*60*1000, Backlight.find() ) # 2 fps when the eyes stand still, stop rendering and turn the backlight off after 5 minutes without activity
 
 # --[ Define eye shapes, all values in pixels ]--
 #robo.eyes_width(160, 140) # byte leftEye, byte rightEye
@@ -45,6 +53,13 @@ robo.set_idle_mode( ON, 5, 2) # Start idle animation cycle (eyes looking in rand
 # --[ Cyclops mode ]--
 # robo.cyclops = True  #  if turned on, robot has only on eye
 
+# --[ Eye atlas ]--
+# Eyes of blinks and mood transitions rendered ahead of time (built on the first boot, or at
+# install time with "python3 eyeatlas.py"), set the eye geometry first. Building forks worker
+# processes: load it before starting any thread, a fork could copy a lock the thread holds
+robo.load_atlas( os.path.expanduser( "~/.cache/roboeyes" ) )
+presenter.start()
+
 # --[ Initial setup animation ]-- 
 # Give a second to the eyes to open in their default state
 start = ticks_ms()
@@ -76,35 +91,39 @@ robo.curious = True  # bool on/off -> when turned on, height of the outer eyes i
 ser.write(b'sm;s1:-1000;s2:-1000\n')  # Send as bytes, add newline if Arduino expects it
 
 send_interval = 3  # seconds
-last_send_time =  time.perf_counter()
 
-try:
+def poll_pat():
+	# Ask the Arduino for the pat sensor value, None without answer (blocking, up to the port timeout)
+	ser.reset_input_buffer()
+	ser.write(b'swa;\n')
+	response = ser.readline().decode().strip()
+	if response.startswith("ACK;swa:"):
+		return int(response.split(":")[1])
+	return None
+
+async def watch_pat():
 	while True:
-		current_time = time.perf_counter()
-		if current_time - last_send_time >= send_interval:
-			last_send_time = current_time
-			ser.reset_input_buffer()
-			ser.write(b'swa;\n')
-			time.sleep((1/fps_screen)/1.5)
-			# Check for incoming data
-			response = ser.readline().decode().strip()
-			if response:
-				if response.startswith("ACK;swa:"):
-					value = int(response.split(":")[1])
-					if (value > 9):
-						robo.mood = HAPPY
-						print("PAt Received,Robot happy")
-					else:
-						robo.mood = DEFAULT
-
-				
-		# update eyes drawings
-		robo.update()  
-		time.sleep((1/fps_screen)/1.5) #set refresh rate slightly below fps of screen
+		# the serial exchange runs in a worker thread, the eyes keep animating meanwhile
+		value = await asyncio.to_thread( poll_pat )
+		if value != None:
+			if (value > 9):
+				robo.mood = HAPPY # wakes the eyes up
+				print("PAt Received,Robot happy")
+			elif robo.mood != DEFAULT:
+				robo.mood = DEFAULT
+		await asyncio.sleep( send_interval )
+
+async def main():
+	# the eyes draw each frame at its deadline and sleep in between (see RoboEyes.run())
+	await asyncio.gather( robo.run(), watch_pat() )
 
+try:
+	asyncio.run( main() )
 except KeyboardInterrupt:
 	print("Keyboard interrupt caught. Exiting gracefully...")
-	ser.close()
 except Exception as e:
 	print(f"An error occurred: {e}")
+finally:
 	ser.close()
+	presenter.stop()
+	print(presenter)
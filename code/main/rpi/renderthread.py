@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+""" Render thread for RoboEyes.
+
+	The thread owns the RoboEyes: it calls update() at each frame deadline (see
+	RoboEyes.next_frame_in()) and sleeps in between. Other threads never touch the eyes,
+	they post commands (functions called with the RoboEyes) to a bounded deque, usually
+	through the proxy:
+
+	renderer = RenderThread( robo ).start()
+	eyes = renderer.eyes
+	eyes.mood = HAPPY
+	eyes.blink()
+	eyes.sequences[0].start() # attributes chain too, only the final call is posted
+
+	The render thread applies every queued command right before a frame, so a frame never
+	shows half of a change, and wakes up as soon as a command arrives. Blocking I/O on the
+	other threads (a serial readline() with a timeout...) no longer delays frames: stats()
+	reports how late the frames were drawn compared to their deadline.
+
+	An assignment replaces the queued assignment of the same attribute, only the latest value
+	is applied. Calls queue up to max_commands, then post() raises QueueFull: no command is
+	ever dropped silently.
+"""
+import threading
+from collections import deque
+
+from roboeyes import ticks_diff
+
+STATS_FRAMES = 1000 # frames kept for stats()
+
+
+class _Chain:
+	# attribute path from the RoboEyes, resolved on the render thread
+	__slots__ = [ "_renderer", "_path" ]
+
+	def __init__( self, renderer, path ):
+		object.__setattr__( self, "_renderer", renderer )
+		object.__setattr__( self, "_path", path )
+
+	def _resolve( self, robo ):
+		target = robo
+		for name in self._path:
+			target = target[name] if isinstance( name, int ) else getattr( target, name )
+		return target
+
+	def __getattr__( self, name ):
+		return _Chain( self._renderer, self._path + ( name, ) )
+
+	def __getitem__( self, index ):
+		return _Chain( self._renderer, self._path + ( index, ) )
+
+	def __setattr__( self, name, value ):
+		self._renderer.post( lambda robo: setattr( self._resolve( robo ), name, value ), key=self._path + ( name, ) )
+
+	def __call__( self, *args, **kwargs ):
+		self._renderer.post( lambda robo: self._resolve( robo )( *args, **kwargs ) )
+
+
+class QueueFull( RuntimeError ):
+	""" post() found max_commands commands waiting: the render thread is behind. """
+
+
+class RenderThread:
+	def __init__( self, robo, max_commands=64 ):
+		self.robo = robo
+		self.eyes = _Chain( self, () ) # proxy posting the calls and assignments made on it
+		self.max_commands = max_commands # commands waiting at most, post() raises past it
+		self.frames = 0 # frames drawn by update()
+		self.commands = 0 # commands applied
+		self.coalesced = 0 # assignments replaced by a newer one of the same attribute
+		self.rejected = 0 # commands refused with QueueFull
+		self.errors = 0 # commands that raised, the exception is printed
+		self.lateness = deque( maxlen=STATS_FRAMES ) # ms between deadline and drawing, last frames
+		self._commands = deque() # ( key, command ), key None for a call
+		self._cond = threading.Condition() # guards the queue, coalesced and rejected (posting threads)
+		self._thread = None
+		self._running = False
+
+	def start( self ):
+		self._running = True
+		self._thread = threading.Thread( target=self._run, name="roboeyes-render", daemon=True )
+		self._thread.start()
+		return self
+
+	def stop( self ):
+		""" Apply the waiting commands, then stop the thread. """
+		with self._cond:
+			self._running = False
+			self._cond.notify()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def __enter__( self ):
+		return self.start()
+
+	def __exit__( self, *exc ):
+		self.stop()
+
+	def post( self, command, key=None ):
+		""" Queue command( robo ) for the render thread. Returns immediately. A command with
+		    a key (the proxy uses the attribute path of assignments) replaces the waiting one
+		    with the same key. Raises QueueFull when max_commands commands are waiting. """
+		with self._cond:
+			if key is not None:
+				for i, (waiting, _command) in enumerate( self._commands ):
+					if waiting == key:
+						del self._commands[i]
+						self.coalesced += 1
+						break
+			if len( self._commands ) >= self.max_commands:
+				self.rejected += 1
+				raise QueueFull( "%d commands waiting for the render thread" % len( self._commands ) )
+			self._commands.append( ( key, command ) )
+			self._cond.notify()
+
+	def _apply( self ):
+		with self._cond:
+			commands = list( self._commands )
+			self._commands.clear()
+		for _key, command in commands:
+			try:
+				command( self.robo )
+			except Exception as e:
+				self.errors += 1
+				print( "RoboEyes command failed:", repr( e ) )
+			self.commands += 1
+
+	def _run( self ):
+		robo = self.robo
+		while True:
+			running = self._running # read first: what was posted before stop() is applied
+			self._apply()
+			if not running:
+				return
+			due = robo.next_frame_at()
+			drawn = robo.fpsTimer
+			robo.update()
+			if robo.fpsTimer != drawn:
+				self.frames += 1
+				if drawn: # the first frame has no deadline
+					self.lateness.append( max( 0, ticks_diff( robo.fpsTimer, due ) ) )
+			wait = robo.next_frame_in()
+			with self._cond:
+				if not self._commands and self._running:
+					self._cond.wait( None if wait == None else wait / 1000 )
+
+	def stats( self ):
+		""" Lateness of the last frames (ms after their deadline): mean, 99th percentile, max. """
+		late = sorted( self.lateness )
+		if not late:
+			return { "frames": 0, "mean": 0, "p99": 0, "max": 0 }
+		return { "frames": len( late ), "mean": sum( late ) / len( late ),
+			"p99": late[ min( len( late ) - 1, len( late ) * 99 // 100 ) ], "max": late[-1] }
+
+	def __repr__( self ):
+		s = self.stats()
+		return "RenderThread(frames=%d, commands=%d, coalesced=%d, rejected=%d, late mean %.1f ms, p99 %.1f ms, max %.1f ms)" % (
+			self.frames, self.commands, self.coalesced, self.rejected, s["mean"], s["p99"], s["max"] )
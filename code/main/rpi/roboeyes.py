@@ -10,10 +10,15 @@
 #
 # GNU General Public License  <https://www.gnu.org/licenses/>.
 #
-from fbutil import FBUtil
+from fbutil import FBUtil, composite
+from display_fbgen import subtract_rects
 from random import randint
+import asyncio
+from heapq import heappush, heappop
 import time
 
+import numpy as np
+
 start_timer_val = time.perf_counter()  # high-precision timer 
 
 def ticks_diff(a,b):
@@ -53,8 +58,79 @@ W  = const( 7 ) # west, middle left
 NW = const( 8 ) # north-west, top left 
 # for middle center set "DEFAULT"
 
+# Animated eye state: RoboEyes.state holds one row (plane) per kind of value and one column
+# per channel; the attributes below read and write it. Channels are ordered by tweening step.
+_CURRENT = const( 0 ) # value drawn
+_NEXT    = const( 1 ) # value tweened towards
+_DEFAULT = const( 2 ) # value of the eye geometry (eyes_width(), ...)
+STATE_CHANNELS = (
+	# current, next, default attribute names
+	( "eyeLheightCurrent", "eyeLheightNext", "eyeLheightDefault" ), # 0-1: heights
+	( "eyeRheightCurrent", "eyeRheightNext", "eyeRheightDefault" ),
+	( "eyeLwidthCurrent", "eyeLwidthNext", "eyeLwidthDefault" ), # 2-9: depend on the heights
+	( "eyeRwidthCurrent", "eyeRwidthNext", "eyeRwidthDefault" ),
+	( "spaceBetweenCurrent", "spaceBetweenNext", "spaceBetweenDefault" ),
+	( "eyeLborderRadiusCurrent", "eyeLborderRadiusNext", "eyeLborderRadiusDefault" ),
+	( "eyeRborderRadiusCurrent", "eyeRborderRadiusNext", "eyeRborderRadiusDefault" ),
+	( "eyeLx", "eyeLxNext", "eyeLxDefault" ),
+	( "eyeLy", "eyeLyNext", "eyeLyDefault" ),
+	( "eyeRy", "eyeRyNext", "eyeRyDefault" ),
+	( "eyeRx", "eyeRxNext", "eyeRxDefault" ), # 10: depends on the widths and space
+	( "eyelidsTiredHeight", "eyelidsTiredHeightNext", None ), # 11-13: depend on the drawn height
+	( "eyelidsAngryHeight", "eyelidsAngryHeightNext", None ),
+	( "eyelidsHappyBottomOffset", "eyelidsHappyBottomOffsetNext", None ),
+)
+
+class StateField:
+	# RoboEyes attribute stored in RoboEyes.state[ plane, channel ]
+	__slots__ = [ "plane", "channel" ]
+
+	def __init__( self, plane, channel ):
+		self.plane = plane
+		self.channel = channel
+
+	def __get__( self, robo, owner=None ):
+		if robo is None:
+			return self
+		value = float( robo.state[ self.plane, self.channel ] )
+		# only the drawn values are tweened through fractions of pixels: the targets and the
+		# geometry stay ints, usable in range() or slices as before
+		return value if self.plane == _CURRENT else round( value )
+
+	def __set__( self, robo, value ):
+		robo.state[ self.plane, self.channel ] = value
+
+def _resolve( fut ):
+	if not fut.done():
+		fut.set_result( None )
+
+def state_changes( before, after ):
+	# Names of the state attributes differing between two RoboEyes.snapshot()
+	planes, channels = np.nonzero( before != after )
+	return [ STATE_CHANNELS[c][p] for p, c in zip( planes.tolist(), channels.tolist() ) ]
+
+
+class Animation:
+	""" Returned by the animation methods (blink(), laugh(), Sequence.play()...). Ignore it,
+	    or await it in a task while RoboEyes.run() drives the eyes to wait for the end of
+	    the animation. """
+	__slots__ = [ "owner", "steps" ]
+
+	def __init__( self, owner, *steps ):
+		self.owner = owner # the RoboEyes class
+		self.steps = steps # functions becoming True in turn, checked after each update()
+
+	def __await__( self ):
+		return self._wait().__await__()
+
+	async def _wait( self ):
+		for _done in self.steps:
+			while not _done():
+				await self.owner.next_update()
+
+
 class StepData:
-	__slots__ = [ "done", "ms_timing", "_lambda" ]
+	__slots__ = [ "done", "ms_timing", "_lambda", "owner_seq" ]
 
 	def __init__( self, owner_seq, ms_timing, _lambda ):
 		super().__init__()
@@ -75,49 +151,120 @@ class StepData:
 
 
 class Sequence( list ):
-	""" a Sequence is a collection of Steps """
-	def __init__( self, owner, name ):
+	""" a Sequence is a collection of Steps, kept sorted by timing """
+	def __init__( self, owner, name, scheduler=None ):
 		super().__init__()
 		self.owner = owner # the RoboEyes class
 		self.name = name
+		self.scheduler = scheduler # Sequences running the steps when due (None: call update())
 		self._start = None
+		self._next = 0 # index of the next step to execute
+		self._run = 0 # incremented by start() and reset(): tells the scheduled runs apart
+		self._repeat = 1 # runs left, None for ever
+		self._period = None # ms between two runs (None: timing of the last step)
 
 	def step( self, ms_timing, _lambda ):
-		# Append a step at a given timing
-		_r = StepData( self.owner, ms_timing, _lambda )
-		self.append( _r )
-
-	def start( self ):
+		# Append a step at a given timing (after the steps with the same timing)
+		_r = StepData( self, ms_timing, _lambda )
+		_i = len( self )
+		while _i > 0 and self[_i-1].ms_timing > ms_timing:
+			_i -= 1
+		self.insert( _i, _r )
+		if _i < self._next: # before the running position: part of the next run
+			_r.done = True
+			self._next += 1
+		self._schedule()
+
+	def start( self, repeat=1, period=None ):
 		# Start the sequence
-		self._start = ticks_ms()
+		# repeat : number of runs, None to loop until reset() / cancel()
+		# period : ms between the start of two runs, default the timing of the last step
+		self._start = self.owner.clock()
+		self._run += 1
+		self._repeat = repeat
+		self._period = period
+		self._schedule()
+
+	def play( self, repeat=1, period=None ):
+		# Play the sequence from its first step (a finished one too), the returned Animation
+		# ends with it
+		self.reset()
+		self.start( repeat, period )
+		return Animation( self.owner, lambda: self.done )
 
 	def reset( self ):
 		# Reset the animation sequence
 		self._start = None
+		self._next = 0
+		self._run += 1 # drops the scheduled steps
 		for _step in self:
 			_step.done = False
 
+	def cancel( self ):
+		# Stop the sequence, its pending steps are not executed
+		self.reset()
+
 	@property
 	def done( self ):
 		if self._start == None:
 			return True
-		return all([ _step.done for _step in self ])
+		return self._next >= len( self )
+
+	def next_step_at( self ):
+		# Time of the next step to execute, None when there is none
+		if self._start == None or self._next >= len( self ):
+			return None
+		return self._start + self[self._next].ms_timing
 
 	def update( self, ticks_ms ):
-		# Check if we have to execute a step
+		# Execute the due steps, in timing order
 		if self._start == None:
 			return
-		[ _step.update( ticks_ms ) for _step in self if _step.done==False ]
+		_run = self._run
+		while self._next < len( self ):
+			_step = self[self._next]
+			_step.update( ticks_ms )
+			if self._run != _run: # the step restarted or reset the sequence
+				return
+			if not _step.done:
+				break
+			self._next += 1
+			if self._next == len( self ) and self._repeat != 1:
+				self._rewind( ticks_ms )
+		self._schedule()
+
+	def _rewind( self, ticks_ms ):
+		# Start the next run, period ms after the previous one (now when far behind)
+		if self._repeat != None:
+			self._repeat -= 1
+		_period = max( 1, self[-1].ms_timing if self._period == None else self._period )
+		self._start += _period
+		if ticks_diff( ticks_ms, self._start ) >= _period:
+			self._start = ticks_ms
+		self._next = 0
+		for _step in self:
+			_step.done = False
+
+	def _schedule( self ):
+		# Tell the scheduler when the next step is due
+		_due = self.next_step_at()
+		if self.scheduler != None and _due != None:
+			self.scheduler.schedule( _due, self )
 
 
 class Sequences( list ):
-	""" Collection of Sequence (each Sequence made of Steps) """
+	""" Collection of Sequence (each Sequence made of Steps)
+
+	    The started sequences wait in a heap keyed by the time of their next step: update()
+	    only looks at the sequences having a step due, whatever the number of steps. """
 	def __init__( self, owner ):
 		super().__init__()
 		self.owner = owner # the RoboEyes class
+		self._heap = [] # ( due, order, sequence, run )
+		self._order = 0 # keeps the heap entries of a same due time in scheduling order
 
 	def add( self, name  ):
-		_r = Sequence( self.owner, name ) # List of steps 
+		_r = Sequence( self.owner, name, self ) # List of steps 
 		self.append( _r )
 		return _r
 
@@ -126,27 +273,81 @@ class Sequences( list ):
 		# All sequences are done ?
 		return all( [ _seq.done for _seq in self ] )
 
+	def schedule( self, due, seq ):
+		# Run seq.update() at due. Entries left behind by a reset() or an earlier step are
+		# skipped when they come up
+		self._order += 1
+		heappush( self._heap, ( due, self._order, seq, seq._run ) )
+
+	def _pending( self, entry ):
+		due, _order, seq, run = entry
+		return run == seq._run and due == seq.next_step_at()
+
 	def update( self ):
-		# Check the various sequences for step to execute
-		_ms_ticks = ticks_ms()
-		[ _seq.update( _ms_ticks ) for _seq in self ]
+		# Execute the due steps of the started sequences
+		_ms_ticks = self.owner.clock()
+		_heap = self._heap
+		while _heap and ticks_diff( _ms_ticks, _heap[0][0] ) >= 0:
+			_entry = heappop( _heap )
+			if self._pending( _entry ):
+				_entry[2].update( _ms_ticks )
+
+	def cancel( self ):
+		# Stop all the sequences
+		for _seq in self:
+			_seq.cancel()
+		self._heap.clear()
+
+	def next_step_at( self ):
+		# Time of the next step to execute in the started sequences, None when there is none
+		_heap = self._heap
+		while _heap and not self._pending( _heap[0] ):
+			heappop( _heap )
+		return _heap[0][0] if _heap else None
 
 
 class RoboEyes():
-	def __init__(self, fb, width, height, frame_rate=20, on_show=None, bgcolor=BGCOLOR, fgcolor=FGCOLOR ):
+	def __init__(self, fb, width, height, frame_rate=20, on_show=None, bgcolor=BGCOLOR, fgcolor=FGCOLOR, clock=None ):
 		# on_show : callback event function( robo_eyes ) when framebuffer shoud be sent to display
+		# clock : function returning the time in ms (default ticks_ms), animations are timed with it
 		assert on_show != None, "on_show event not defined"
 		self.fb = fb # FrameBuffer
+		self.state = np.zeros( (3, len( STATE_CHANNELS )) ) # animated values, see STATE_CHANNELS
 		self.gfx = FBUtil( fb ) # Extra drawing methods 
+		self.compose = True # write the final eye pixels once instead of painting lids over the eyes
+		self.pixels_written = 0 # pixels the last frame wrote into the framebuffer
+		self.skipped_frames = 0 # frames not drawn because they matched the one on screen
+		self._last_frame = None # shapes and colors of the frame on screen
+		self.display_list = False # record each frame and only redraw what differs from the last one
+		self._last_list = None # optimized DisplayList of the frame on screen
+		self._last_boxes = None # screen areas holding the eyes on screen, None: unknown
+		self.atlas = None # eyeatlas.EyeAtlas of the eye geometry, see load_atlas()
+		self.atlasDir = None # where the atlases are stored, None: no atlas
+		self.atlasStale = False # geometry changed, look for the atlas of the new one
 		self.on_show = on_show
 		self.screenWidth = width # OLED display width, in pixels
 		self.screenHeight = height # OLED display height, in pixels
-		self.bgcolor = bgcolor
+		self.bgcolor = bgcolor # converted once to the framebuffer's native format (see properties)
 		self.fgcolor = fgcolor
 
+		self.clock = clock or ticks_ms
 		self.sequences = Sequences( self ) # Collection of sequences
+		self.timeline = None # Timeline playing (see play_timeline())
+		self.timelineStart = 0
+		self.timelineLids = None # ( channels, targets ) of the eyelid tracks of the last timeline, kept until the mood is set
+		self._waiters = [] # futures of next_update()
+		self._nudge = None # future run() waits on until the next frame
 
 		self.fpsTimer = 0 # For timing the Frames per seconds
+
+		# --[ Power saving - frame rate governor ]--
+		self.powerSaving = False # see set_power_saving()
+		self.restFrameRate = 2 # frame rate once the eyes stopped moving
+		self.sleepAfter = None # ms without activity before sleeping, None: never
+		self.backlight = None # dimmed while asleep, see backlight.Backlight
+		self.settled = False # the last frame was identical to the one on screen
+		self.asleep = False # no rendering until wake()
+		self.activityTimer = self.clock() # time of the last wake()
 		self._position = 0 # see position property. Last known value N,S,E,W, ....
 		
 		# --[ controlling mood types and expressions ]--
@@ -227,15 +428,24 @@ class RoboEyes():
 		#  Macro Animations
 		# -----------------
 
+		# --[ Animation - tweening ]--
+		# sizes, positions and eyelids move towards their next value by halving the remaining
+		# distance every tweenHalfLife ms, whatever the frame rate (50 ms: one frame at 20 fps)
+		self.tweenHalfLife = 50
+		self.tweenTimer = None # time of the last tweening step
+
 		# --[ Animation - horizontal flicker/shiver ]--
+		self.flickerInterval = 50 # ms between two flicker displacements (at most one per frame)
 		self.hFlicker = False
 		self.hFlickerAlternate = False
 		self.hFlickerAmplitude = 2
+		self.hFlickerTimer = 0
 
 		# --[ Animation - vertical flicker/shiver ]--
 		self.vFlicker = False
 		self.vFlickerAlternate = False
 		self.vFlickerAmplitude = 10
+		self.vFlickerTimer = 0
 
 		# --[ Animation - auto blinking ]--
 		self.autoblinker = False # activate auto blink animation
@@ -277,16 +487,141 @@ class RoboEyes():
 	# -----------------------------------------------------
 
 	def update( self ):
+		self._update()
+		if self._waiters: # resume the tasks awaiting an animation
+			_waiters, self._waiters = self._waiters, []
+			for _fut in _waiters:
+				if not _fut.done():
+					_fut.set_result( None )
+
+	def _update( self ):
 		# Check if a sequence step must be executed
 		self.sequences.update() 
+		now = self.clock()
+		if self.powerSaving:
+			if self.asleep:
+				return
+			if self.sleepAfter != None and self.timeline == None and ticks_diff( now, self.activityTimer ) >= self.sleepAfter:
+				self.sleep()
+				return
 		# Limit drawing updates to defined max framerate
-		if ticks_diff( ticks_ms(), self.fpsTimer ) >= self.frameInterval:
+		if ticks_diff( now, self.next_frame_at() ) >= 0:
 			self.draw_eyes()
-			self.fpsTimer = ticks_ms()
+			self.fpsTimer = now
+
+	def next_frame_at( self ):
+		# Time the next frame is due: at frame_rate while something moves, at restFrameRate
+		# once settled (power saving) unless a blink or an idle move starts earlier
+		if not( self.powerSaving and self.settled ) or self.timeline != None:
+			return self.fpsTimer + self.frameInterval
+		soonest = self.fpsTimer + self.frameInterval
+		due = self.fpsTimer + 1000//self.restFrameRate
+		if self.autoblinker:
+			due = min( due, max( self.blinktimer, soonest ) )
+		if self.idle:
+			due = min( due, max( self.idleAnimationTimer, soonest ) )
+		return due
+
+	def next_frame_in( self ):
+		# ms before update() has something to do: sleep that long between two calls instead
+		# of spinning. None when asleep with no sequence step to run (only wake() ends it)
+		now = self.clock()
+		due = self.sequences.next_step_at()
+		if not self.asleep:
+			due = self.next_frame_at() if due == None else min( due, self.next_frame_at() )
+			if self.powerSaving and self.sleepAfter != None:
+				due = min( due, self.activityTimer + self.sleepAfter )
+		if due == None:
+			return None
+		return max( 0, ticks_diff( due, now ) )
+
+	# Drive the eyes on the running asyncio loop until cancelled: update() at each frame or
+	# sequence step deadline (see next_frame_in()), sleeping in between. A change made by
+	# another task (mood, blink, wake()...) brings the next update forward.
+	async def run( self ):
+		loop = asyncio.get_running_loop()
+		while True:
+			self.update()
+			wait = self.next_frame_in()
+			self._nudge = loop.create_future()
+			timer = None
+			if wait != None:
+				timer = loop.call_at( loop.time() + wait/1000, _resolve, self._nudge )
+			try:
+				await self._nudge
+			finally:
+				self._nudge = None
+				if timer != None:
+					timer.cancel()
+
+	# Future done after the next update(), for tasks waiting on the eyes
+	def next_update( self ):
+		_fut = asyncio.get_running_loop().create_future()
+		self._waiters.append( _fut )
+		return _fut
+
+	def _resume( self ):
+		# Update now instead of at the deadline run() sleeps until
+		if self._nudge != None and not self._nudge.done():
+			self._nudge.set_result( None )
+
+	# Something happened (state change, sensor event): back to the full frame rate and
+	# restart the inactivity period
+	def wake( self ):
+		self.activityTimer = self.clock()
+		self.settled = False
+		self._resume()
+		if self.asleep:
+			self.asleep = False
+			if self.backlight != None:
+				self.backlight.wake()
+
+	# Stop rendering until wake(), dim the backlight
+	def sleep( self ):
+		self.asleep = True
+		self.tweenTimer = None # the first frame after wake() moves one frame step
+		if self.backlight != None:
+			self.backlight.sleep()
 	
 
 	def clear_display( self ):
 		self.fb.fill( self.bgcolor )
+		self.invalidate() # the eyes are gone from the screen
+
+	def invalidate( self ):
+		# Draw the next frame even if the eyes did not change, e.g. after drawing something
+		# else on the framebuffer
+		self._last_frame = None
+		self._last_list = None
+		self._last_boxes = None
+
+	@staticmethod
+	def _color_key( color ):
+		# comparable form of a color, native colors can be arrays (24 bits formats)
+		return tuple( color.tolist() ) if hasattr( color, "ndim" ) and color.ndim else color
+
+	def _native_color( self, color ):
+		# Pre-convert a color to the framebuffer pixel format when it knows how to
+		if hasattr( self.fb, "color" ):
+			return self.fb.color( color )
+		return color
+
+	@property
+	def bgcolor( self ):
+		return self._bgcolor
+
+	@bgcolor.setter
+	def bgcolor( self, color ):
+		self._bgcolor = self._native_color( color )
+		self.invalidate() # the whole screen changes, not only the eyes
+
+	@property
+	def fgcolor( self ):
+		return self._fgcolor
+
+	@fgcolor.setter
+	def fgcolor( self, color ):
+		self._fgcolor = self._native_color( color )
 
 	# --- SETTER METHODS ----------------------------------
 	#
@@ -296,8 +631,67 @@ class RoboEyes():
 	def set_framerate( self, fps ):
 		self.frameInterval = 1000//fps
 
+	# Animate the eyes along the keyframed tracks of a timeline.Timeline, from now on
+	def play_timeline( self, timeline ):
+		self.wake()
+		self.timeline = timeline
+		self.timelineLids = None
+		self.timelineStart = self.clock()
+
+	# Stop the timeline, the eyes stay where it left them (the eyelids until the mood is set)
+	def stop_timeline( self ):
+		if self.timeline != None:
+			self._hold_lids( self.timeline, self.state[_NEXT, self.timeline.channels] )
+		self.timeline = None
+
+	def _hold_lids( self, timeline, row ):
+		# Keep the last eyelid targets of timeline over the mood's once it is no longer playing
+		lids = timeline.channels[timeline.lids:]
+		self.timelineLids = ( lids, row[timeline.lids:].copy() ) if len( lids ) else None
+
+	# Take the eyes from a precomputed atlas stored in directory (see eyeatlas.py), built
+	# first when missing and build is True. Changing the eye geometry switches to the atlas
+	# of the new geometry if it was built, else the eyes are composed as usual.
+	def load_atlas( self, directory, build=True ):
+		from eyeatlas import EyeAtlas
+		self.atlasDir = directory
+		self.atlasStale = False
+		self.atlas = EyeAtlas.load( directory, self, build )
+		return self.atlas
+
+	# Fraction of the remaining distance an animated value covers since the last frame
+	def tween_factor( self, now ):
+		elapsed = self.frameInterval if self.tweenTimer == None else ticks_diff( now, self.tweenTimer )
+		self.tweenTimer = now
+		if self.atlas != None:
+			# whole frame steps, like the animations the atlas was built from: a frame a few
+			# ms late draws the same eyes, a dropped frame two steps at once
+			elapsed = max( 1, round( elapsed / self.frameInterval ) ) * self.frameInterval
+		if self.tweenHalfLife <= 0:
+			return 1
+		return 1 - 0.5 ** ( max( elapsed, 0 ) / self.tweenHalfLife )
+
+	@staticmethod
+	def tween( state, start, stop, target, k ):
+		# Move the current values of channels start to stop-1 towards target, landing on it
+		# once less than half a pixel away
+		current = state[_CURRENT, start:stop]
+		current += (target - current) * k
+		np.copyto( current, target, where=np.abs( target - current ) < 0.5 )
+
+	# Copy of the animated state (see STATE_CHANNELS), for restore(), state_changes() or
+	# to save it (snapshot().tolist())
+	def snapshot( self ):
+		return self.state.copy()
+
+	def restore( self, snapshot ):
+		self.state[:] = snapshot
+		self.wake()
+
 
 	def eyes_width( self, leftEye=None, rightEye=None):
+		self.wake()
+		self.atlasStale = True # the atlas was built for the previous geometry
 		if leftEye!=None:
 			self.eyeLwidthNext = leftEye
 			self.eyeLwidthDefault = leftEye
@@ -307,6 +701,8 @@ class RoboEyes():
 
 
 	def eyes_height( self, leftEye=None, rightEye=None ):
+		self.wake()
+		self.atlasStale = True # the atlas was built for the previous geometry
 		if leftEye!=None:
 			self.eyeLheightNext = leftEye
 			self.eyeLheightDefault = leftEye
@@ -317,6 +713,8 @@ class RoboEyes():
 
 	# Set border radius for left and right eye
 	def eyes_radius( self, leftEye=None, rightEye=None):
+		self.wake()
+		self.atlasStale = True # the atlas was built for the previous geometry
 		if leftEye!=None:
 			self.eyeLborderRadiusNext = leftEye
 			self.eyeLborderRadiusDefault = leftEye
@@ -327,6 +725,8 @@ class RoboEyes():
 
 	# Set space between the eyes, can also be negative
 	def eyes_spacing( self, space ):
+		self.wake()
+		self.atlasStale = True # the atlas was built for the previous geometry
 		self.spaceBetweenNext = space
 		self.spaceBetweenDefault = space
 
@@ -339,6 +739,8 @@ class RoboEyes():
 
 	@mood.setter
 	def mood( self, mood ):
+		self.wake()
+		self.timelineLids = None # the mood's eyelids again
 		# IF old mood was in fickering AND new mood not flinkering THEN
 		if ( self._mood in (SCARY,FROZEN) ) and not( mood in (SCARY,FROZEN) ):
 			self.horiz_flicker( False )
@@ -394,6 +796,7 @@ class RoboEyes():
 
 	@position.setter
 	def position( self, direction ):
+		self.wake()
 		if direction == N: # North, top center
 			self.eyeLxNext = self.get_screen_constraint_X()//2
 			self.eyeLyNext = 0
@@ -430,6 +833,7 @@ class RoboEyes():
 
 	# Set automated eye blinking, minimal blink interval in full seconds and blink interval variation range in full seconds
 	def set_auto_blinker( self, active, interval=None, variation=None):
+		self.wake()
 		self.autoblinker = active
 		if interval != None:
 			self.blinkInterval = interval
@@ -437,8 +841,22 @@ class RoboEyes():
 			self.blinkIntervalVariation = variation
 
 
+	# Set the frame rate governor: frame_rate while animating, rest_fps once the eyes stopped moving,
+	# sleep (no rendering, backlight dimmed) after sleep_after ms without activity (None: never)
+	def set_power_saving( self, active, rest_fps=None, sleep_after=None, backlight=None ):
+		self.wake()
+		self.powerSaving = active
+		if rest_fps != None:
+			self.restFrameRate = rest_fps
+		if sleep_after != None:
+			self.sleepAfter = sleep_after
+		if backlight != None:
+			self.backlight = backlight
+
+
 	# Set idle mode - automated eye repositioning, minimal time interval in full seconds and time interval variation range in full seconds
 	def set_idle_mode( self, active, interval=None, variation=None):
+		self.wake()
 		self.idle = active
 		if interval != None:
 			self.idleInterval = interval
@@ -451,6 +869,7 @@ class RoboEyes():
 
 	@curious.setter
 	def curious( self, enable ):
+		self.wake()
 		# Set curious mode - the respectively outer eye gets larger when looking left or right
 		self._curious = enable
 
@@ -465,6 +884,9 @@ class RoboEyes():
 
 	@cyclops.setter
 	def cyclops( self, enabled ):
+		self.wake()
+		if enabled != self._cyclops:
+			self.atlasStale = True # the atlas was built for the other mode
 		self._cyclops = enabled
 
 	# Callable for lambda expression
@@ -473,6 +895,7 @@ class RoboEyes():
 
 	# Set horizontal flickering (displacing eyes left/right)
 	def horiz_flicker( self, enable, amplitude=None ):
+		self.wake()
 		self.hFlicker = enable # turn flicker on or off
 		if amplitude != None:
 			self.hFlickerAmplitude = amplitude # define amplitude of flickering in pixels
@@ -480,6 +903,7 @@ class RoboEyes():
 
 	# Set vertical flickering (displacing eyes up/down)
 	def vert_flicker( self, enable, amplitude=None ):
+		self.wake()
 		self.vFlicker = enable # turn flicker on or off
 		if amplitude  != None:
 			self.vFlickerAmplitude = amplitude #  define amplitude of flickering in pixels
@@ -492,13 +916,13 @@ class RoboEyes():
 
 	# Returns the max x position for left eye
 	def get_screen_constraint_X( self ):
-		return self.screenWidth-self.eyeLwidthCurrent-self.spaceBetweenCurrent-self.eyeRwidthCurrent
+		return round( self.screenWidth-self.eyeLwidthCurrent-self.spaceBetweenCurrent-self.eyeRwidthCurrent )
 
 
 	# Returns the max y position for left eye
 	def get_screen_constraint_Y( self ):
 		# using default height here, because height will vary when blinking and in curious mode
-		return self.screenHeight-self.eyeLheightDefault 
+		return round( self.screenHeight-self.eyeLheightDefault )
 
 
 	# --- BASIC ANIMATION METHODS -------------------------
@@ -508,6 +932,7 @@ class RoboEyes():
 	# --[ BLINKING FOR BOTH EYES AT ONCE or separately ]--
 	# Close both eyes
 	def close( self, left=None, right=None ):
+		self.wake()
 		if (left==None) and (right==None):
 			self.eyeLheightNext = 1 # closing left eye
 			self.eyeRheightNext = 1 # closing right eye
@@ -520,10 +945,11 @@ class RoboEyes():
 			if right != None:
 				self.eyeRheightNext = 1 # blinking right eye
 				self.eyeR_open = False # right eye not opened (=closed)
-
+		return Animation( self, lambda: self._eyes_closed( left, right ) )
 
 	# Open both eyes
 	def open( self, left=None, right=None ):
+		self.wake()
 		if (left==None) and (right==None):
 			self.eyeL_open = True # left eye opened - if true, draw_eyes() will take care of opening eyes again
 			self.eyeR_open = True # right eye opened
@@ -532,6 +958,7 @@ class RoboEyes():
 				self.eyeL_open = True # left eye opened - if true, draw_eyes() will take care of opening eyes again
 			if right != None:
 				self.eyeR_open = True # right eye opened
+		return Animation( self, lambda: self._eyes_opened( left, right ) )
 
 	# Trigger eyeblink animation
 	def blink( self, left=None, right=None ):
@@ -541,6 +968,21 @@ class RoboEyes():
 		else:
 			self.close( left, right )
 			self.open( left, right )
+		return Animation( self, lambda: self._eyes_closed( left, right ), lambda: self._eyes_opened( left, right ) )
+
+	# The eyes close(), open() and blink() work on (both when left and right are None)
+	# are closed, are open again. Cyclops mode only has the left one
+	def _eyes_closed( self, left, right ):
+		both = (left==None) and (right==None)
+		return ( not( both or left != None ) or self.eyeLheightCurrent <= 1 + self.eyeLheightOffset ) and \
+			( self._cyclops or not( both or right != None ) or self.eyeRheightCurrent <= 1 + self.eyeRheightOffset )
+
+	def _eyes_opened( self, left, right ):
+		both = (left==None) and (right==None)
+		return ( not( both or left != None ) or ( self.eyeLheightCurrent > 1 + self.eyeLheightOffset and
+				abs( self.eyeLheightCurrent - self.eyeLheightNext - self.eyeLheightOffset ) < 0.5 ) ) and \
+			( self._cyclops or not( both or right != None ) or ( self.eyeRheightCurrent > 1 + self.eyeRheightOffset and
+				abs( self.eyeRheightCurrent - self.eyeRheightNext - self.eyeRheightOffset ) < 0.5 ) )
 
 	# --- MACRO ANIMATION METHODS -------------------------
 	#
@@ -548,25 +990,45 @@ class RoboEyes():
 
 	# Play confused animation - one shot animation of eyes shaking left and right
 	def confuse( self ):
+		self.wake()
 		self._confused = True
+		return Animation( self, lambda: not self._confused )
 
 
 	# Play laugh animation - one shot animation of eyes shaking up and down
 	def laugh( self ):
+		self.wake()
 		self._laugh = True
+		return Animation( self, lambda: not self._laugh )
 
 
 	def wink( self, left=None, right=None ):
 		assert left or right, "Wink must be activated on right or left"
 		self.autoblinker = False # activate auto blink animation
 		self.idle = False 
-		self.blink( left=left, right=right )
+		return self.blink( left=left, right=right )
 
 
 	# --- PRE-CALCULATIONS AND ACTUAL DRAWINGS ------------
 	#
 	# -----------------------------------------------------
 	def draw_eyes( self ):
+		# Every animation is evaluated at the frame time: the eyes move at the same speed at
+		# 5 or 30 fps, the frame rate only sets how smooth it looks and the CPU it takes
+		now = self.clock()
+		k = self.tween_factor( now )
+		tween = self.tween
+		state = self.state
+
+		# Keyframed timeline: one table row sets the targets of its tracks
+		timeline = self.timeline
+		if timeline != None:
+			row = timeline.row( ticks_diff( now, self.timelineStart ) )
+			if row is None: # over, its last values stay the targets
+				row = timeline.table[-1]
+				self.timeline = None
+				self._hold_lids( timeline, row )
+			state[_NEXT, timeline.channels] = row
 
 		# --[ PRE-CALCULATIONS - EYE SIZES AND VALUES FOR ANIMATION TWEENINGS ]--
 
@@ -587,14 +1049,9 @@ class RoboEyes():
 			self.eyeLheightOffset = 0 # reset height offset for left eye
 			self.eyeRheightOffset = 0 # reset height offset for right eye
 
-		# Left eye height
-		self.eyeLheightCurrent = (self.eyeLheightCurrent + self.eyeLheightNext + self.eyeLheightOffset)//2
-		self.eyeLy += (self.eyeLheightDefault-self.eyeLheightCurrent)//2 # vertical centering of eye when closing
-		self.eyeLy -= self.eyeLheightOffset//2
-		# Right eye height
-		self.eyeRheightCurrent = (self.eyeRheightCurrent + self.eyeRheightNext + self.eyeRheightOffset)//2
-		self.eyeRy += (self.eyeRheightDefault-self.eyeRheightCurrent)//2 # vertical centering of eye when closing
-		self.eyeRy -= self.eyeRheightOffset//2
+		# Eye heights
+		offsets = np.array( (self.eyeLheightOffset, self.eyeRheightOffset) )
+		tween( state, 0, 2, state[_NEXT, 0:2] + offsets, k )
 
 
 		# Open eyes again after closing them
@@ -606,44 +1063,33 @@ class RoboEyes():
 			if self.eyeRheightCurrent <= (1 + self.eyeRheightOffset):
 				self.eyeRheightNext = self.eyeRheightDefault
 
-		# Left eye width
-		self.eyeLwidthCurrent = (self.eyeLwidthCurrent + self.eyeLwidthNext)//2
-		# Right eye width
-		self.eyeRwidthCurrent = (self.eyeRwidthCurrent + self.eyeRwidthNext)//2
-
-
-		# Space between eyes
-		self.spaceBetweenCurrent = (self.spaceBetweenCurrent + self.spaceBetweenNext)//2
-
-		# Left eye coordinates
-		self.eyeLx = (self.eyeLx + self.eyeLxNext)//2
-		self.eyeLy = (self.eyeLy + self.eyeLyNext)//2
-		# Right eye coordinates
-		self.eyeRxNext = self.eyeLxNext+self.eyeLwidthCurrent+self.spaceBetweenCurrent # right eye's x position depends on left eyes position + the space between
+		# Eye widths, space between eyes, border radius and coordinates; the eyes vertically
+		# centered on their default height when closing
 		self.eyeRyNext = self.eyeLyNext # right eye's y position should be the same as for the left eye
-		self.eyeRx = (self.eyeRx + self.eyeRxNext)//2
-		self.eyeRy = (self.eyeRy + self.eyeRyNext)//2
-
-		# Left eye border radius
-		self.eyeLborderRadiusCurrent = (self.eyeLborderRadiusCurrent + self.eyeLborderRadiusNext)//2
-		# Right eye border radius
-		self.eyeRborderRadiusCurrent = (self.eyeRborderRadiusCurrent + self.eyeRborderRadiusNext)//2
+		target = state[_NEXT, 2:10].copy()
+		target[6:8] = state[_NEXT, 8:10] + (state[_DEFAULT, 0:2]-state[_CURRENT, 0:2])/2 - offsets/2
+		tween( state, 2, 10, target, k )
+		# Right eye x position depends on left eyes position + the space between
+		self.eyeRxNext = self.eyeLxNext+self.eyeLwidthCurrent+self.spaceBetweenCurrent
+		tween( state, 10, 11, state[_NEXT, 10:11], k )
 		  
 
 		# --[ APPLYING MACRO ANIMATIONS ]--
+		# they run on their own: blinks and flickering started here are no activity
+		activity = self.activityTimer
 
 		if self.autoblinker:
-			if ticks_diff( ticks_ms(), self.blinktimer ) >=  0:
+			if ticks_diff( now, self.blinktimer ) >=  0:
 				self.blink()
-				self.blinktimer =  ticks_ms() +  (self.blinkInterval*1000)+(randint(0,self.blinkIntervalVariation)*1000)  # calculate next time for blinking
+				self.blinktimer =  now +  (self.blinkInterval*1000)+(randint(0,self.blinkIntervalVariation)*1000)  # calculate next time for blinking
 
 		# Laughing - eyes shaking up and down for the duration defined by laughAnimationDuration (default = 500ms)
 		if self._laugh:
 			if self.laughToggle:
 				self.vert_flicker(1, 5)
-				self.laughAnimationTimer = ticks_ms()
+				self.laughAnimationTimer = now
 				self.laughToggle = False		
-			elif ticks_diff( ticks_ms(), self.laughAnimationTimer ) >= self.laughAnimationDuration:
+			elif ticks_diff( now, self.laughAnimationTimer ) >= self.laughAnimationDuration:
 				self.vert_flicker(0, 0)
 				self.laughToggle = True
 				self._laugh = False
@@ -653,42 +1099,38 @@ class RoboEyes():
 		if self._confused:
 			if self.confusedToggle:
 				self.horiz_flicker(1, 20)
-				self.confusedAnimationTimer = ticks_ms()
+				self.confusedAnimationTimer = now
 				self.confusedToggle = False
-			elif ticks_diff( ticks_ms(), self.confusedAnimationTimer) >= self.confusedAnimationDuration :
+			elif ticks_diff( now, self.confusedAnimationTimer) >= self.confusedAnimationDuration :
 				self.horiz_flicker(0, 0)
 				self.confusedToggle = True
 				self._confused= False
 
 		# Idle - eyes moving to random positions on screen
 		if self.idle:
-			if ticks_diff( ticks_ms(), self.idleAnimationTimer ) >= 0:
+			if ticks_diff( now, self.idleAnimationTimer ) >= 0:
 				self.eyeLxNext = randint( 0, self.get_screen_constraint_X() )
 				self.eyeLyNext = randint( 0, self.get_screen_constraint_Y() )
-				self.idleAnimationTimer =  ticks_ms() + (self.idleInterval*1000)+(randint( 0, self.idleIntervalVariation)*1000)  # calculate next time for eyes repositioning
+				self.idleAnimationTimer =  now + (self.idleInterval*1000)+(randint( 0, self.idleIntervalVariation)*1000)  # calculate next time for eyes repositioning
 			
 
-		# Adding offsets for horizontal flickering/shivering
+		# Offsets for horizontal flickering/shivering, switching side every flickerInterval
+		hFlickerOffset = 0
 		if self.hFlicker:
-			if self.hFlickerAlternate:
-				self.eyeLx += self.hFlickerAmplitude
-				self.eyeRx += self.hFlickerAmplitude
-			else:
-				self.eyeLx -= self.hFlickerAmplitude
-				self.eyeRx -= self.hFlickerAmplitude
-			self.hFlickerAlternate = not( self.hFlickerAlternate )
+			if ticks_diff( now, self.hFlickerTimer ) >= self.flickerInterval:
+				self.hFlickerAlternate = not( self.hFlickerAlternate )
+				self.hFlickerTimer = now
+			hFlickerOffset = self.hFlickerAmplitude if self.hFlickerAlternate else -self.hFlickerAmplitude
 
 
-		# Adding offsets for horizontal flickering/shivering
+		# Offsets for vertical flickering/shivering
+		vFlickerOffset = 0
 		if self.vFlicker:
-			if self.vFlickerAlternate:
-				self.eyeLy += self.vFlickerAmplitude
-				self.eyeRy += self.vFlickerAmplitude
-			else:
-				self.eyeLy -= self.vFlickerAmplitude
-				self.eyeRy -= self.vFlickerAmplitude
-			
-			self.vFlickerAlternate = not(self.vFlickerAlternate)
+			if ticks_diff( now, self.vFlickerTimer ) >= self.flickerInterval:
+				self.vFlickerAlternate = not( self.vFlickerAlternate )
+				self.vFlickerTimer = now
+			vFlickerOffset = self.vFlickerAmplitude if self.vFlickerAlternate else -self.vFlickerAmplitude
+		self.activityTimer = activity
 
 
 		# Cyclops mode, set second eye's size and space between to 0
@@ -699,62 +1141,186 @@ class RoboEyes():
 
 		# --[ ACTUAL DRAWINGS ]--
 
-		self.clear_display() # start with a blank screen
+		# Tweened values are fractional: round them to pixels and add the flickering
+		Lh, Rh, Lw, Rw, _space, Lr, Rr, Lx, Ly, Ry, Rx = np.rint( state[_CURRENT, 0:11] ).astype( int ).tolist()
+		Lx += hFlickerOffset
+		Ly += vFlickerOffset
+		Rx += hFlickerOffset
+		Ry += vFlickerOffset
+
+		# Shapes filled in fgcolor, then in bgcolor over them: ( kind, args ) for gfx.fill_<kind>()
+		fg_shapes = []
+		bg_shapes = []
 
 		# Draw basic eye rectangles
 		#   display.fillRoundRect(eyeLx, eyeLy, eyeLwidthCurrent, eyeLheightCurrent, eyeLborderRadiusCurrent, MAINCOLOR); // left eye
-		self.gfx.fill_rrect( self.eyeLx, self.eyeLy, self.eyeLwidthCurrent, self.eyeLheightCurrent, self.eyeLborderRadiusCurrent, self.fgcolor ) # left eye
+		fg_shapes.append( ("rrect", (Lx, Ly, Lw, Lh, Lr)) ) # left eye
 		
 		if not self._cyclops:
 			# display.fillRoundRect(eyeRx, eyeRy, eyeRwidthCurrent, eyeRheightCurrent, eyeRborderRadiusCurrent, MAINCOLOR); // right eye
-			self.gfx.fill_rrect( self.eyeRx, self.eyeRy, self.eyeRwidthCurrent, self.eyeRheightCurrent, self.eyeRborderRadiusCurrent, self.fgcolor )
+			fg_shapes.append( ("rrect", (Rx, Ry, Rw, Rh, Rr)) )
 
 
 		# Prepare mood type transitions
 		if self.tired:
-			self.eyelidsTiredHeightNext = self.eyeLheightCurrent//2 
+			self.eyelidsTiredHeightNext = Lh//2 
 			self.eyelidsAngryHeightNext = 0
 		else:
 			self.eyelidsTiredHeightNext = 0
 		if self.angry:
-			self.eyelidsAngryHeightNext = self.eyeLheightCurrent//2 
+			self.eyelidsAngryHeightNext = Lh//2 
 			self.eyelidsTiredHeightNext = 0
 		else:
 			self.eyelidsAngryHeightNext = 0
 		if self.happy:
-			self.eyelidsHappyBottomOffsetNext = self.eyeLheightCurrent//2
+			self.eyelidsHappyBottomOffsetNext = Lh//2
 		else:
 			self.eyelidsHappyBottomOffsetNext = 0
+		if timeline != None: # its eyelid tracks win over the mood
+			state[_NEXT, timeline.channels[timeline.lids:]] = row[timeline.lids:]
+		elif self.timelineLids != None: # and stay once it is over, until the mood is set
+			state[_NEXT, self.timelineLids[0]] = self.timelineLids[1]
+
+		tween( state, 11, 14, state[_NEXT, 11:14], k )
+		tiredHeight, angryHeight, happyOffset = np.rint( state[_CURRENT, 11:14] ).astype( int ).tolist()
 
 		# Draw tired top eyelids 
-		self.eyelidsTiredHeight = (self.eyelidsTiredHeight + self.eyelidsTiredHeightNext)//2
 		if not self._cyclops:
-			self.gfx.fill_triangle( self.eyeLx, self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy-1, self.eyeLx, self.eyeLy+self.eyelidsTiredHeight-1, self.bgcolor ) # left eye 
-			self.gfx.fill_triangle( self.eyeRx, self.eyeRy-1, self.eyeRx+self.eyeRwidthCurrent, self.eyeRy-1, self.eyeRx+self.eyeRwidthCurrent, self.eyeRy+self.eyelidsTiredHeight-1, self.bgcolor ) # right eye
+			bg_shapes.append( ("triangle", (Lx, Ly-1, Lx+Lw, Ly-1, Lx, Ly+tiredHeight-1)) ) # left eye 
+			bg_shapes.append( ("triangle", (Rx, Ry-1, Rx+Rw, Ry-1, Rx+Rw, Ry+tiredHeight-1)) ) # right eye
 		else:
 			# Cyclops tired eyelids
-			self.gfx.fill_triangle( self.eyeLx, self.eyeLy-1, self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy-1, self.eyeLx, self.eyeLy+self.eyelidsTiredHeight-1, self.bgcolor ) # left eyelid half
-			self.gfx.fill_triangle( self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy+self.eyelidsTiredHeight-1, self.bgcolor ) # right eyelid half
+			bg_shapes.append( ("triangle", (Lx, Ly-1, Lx+(Lw//2), Ly-1, Lx, Ly+tiredHeight-1)) ) # left eyelid half
+			bg_shapes.append( ("triangle", (Lx+(Lw//2), Ly-1, Lx+Lw, Ly-1, Lx+Lw, Ly+tiredHeight-1)) ) # right eyelid half
 
 
 		# Draw angry top eyelids 
-		self.eyelidsAngryHeight = (self.eyelidsAngryHeight + self.eyelidsAngryHeightNext)//2
 		if not self._cyclops:
-			self.gfx.fill_triangle( self.eyeLx, self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy+self.eyelidsAngryHeight-1, self.bgcolor ) # left eye
-			self.gfx.fill_triangle( self.eyeRx, self.eyeRy-1, self.eyeRx+self.eyeRwidthCurrent, self.eyeRy-1, self.eyeRx, self.eyeRy+self.eyelidsAngryHeight-1, self.bgcolor ) # right eye
+			bg_shapes.append( ("triangle", (Lx, Ly-1, Lx+Lw, Ly-1, Lx+Lw, Ly+angryHeight-1)) ) # left eye
+			bg_shapes.append( ("triangle", (Rx, Ry-1, Rx+Rw, Ry-1, Rx, Ry+angryHeight-1)) ) # right eye
 		else:
 			# Cyclops angry eyelids
-			self.gfx.fill_triangle( self.eyeLx, self.eyeLy-1, self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy-1, self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy+self.eyelidsAngryHeight-1, self.bgcolor ) # left eyelid half
-			self.gfx.fill_triangle( self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy-1, self.eyeLx+self.eyeLwidthCurrent, self.eyeLy-1, self.eyeLx+(self.eyeLwidthCurrent//2), self.eyeLy+self.eyelidsAngryHeight-1, self.bgcolor ) # right eyelid half
+			bg_shapes.append( ("triangle", (Lx, Ly-1, Lx+(Lw//2), Ly-1, Lx+(Lw//2), Ly+angryHeight-1)) ) # left eyelid half
+			bg_shapes.append( ("triangle", (Lx+(Lw//2), Ly-1, Lx+Lw, Ly-1, Lx+(Lw//2), Ly+angryHeight-1)) ) # right eyelid half
 		
 
 
 		# Draw happy bottom eyelids
-		self.eyelidsHappyBottomOffset = (self.eyelidsHappyBottomOffset + self.eyelidsHappyBottomOffsetNext)//2
-		self.gfx.fill_rrect( self.eyeLx-1, (self.eyeLy+self.eyeLheightCurrent)-self.eyelidsHappyBottomOffset+1, self.eyeLwidthCurrent+2, self.eyeLheightDefault, self.eyeLborderRadiusCurrent, self.bgcolor ) # left eye		
+		bg_shapes.append( ("rrect", (Lx-1, (Ly+Lh)-happyOffset+1, Lw+2, round( state[_DEFAULT, 0] ), Lr)) ) # left eye		
 		if not self._cyclops:
-			self.gfx.fill_rrect( self.eyeRx-1, (self.eyeRy+self.eyeRheightCurrent)-self.eyelidsHappyBottomOffset+1, self.eyeRwidthCurrent+2, self.eyeRheightDefault, self.eyeRborderRadiusCurrent, self.bgcolor ) # right eye		
+			bg_shapes.append( ("rrect", (Rx-1, (Ry+Rh)-happyOffset+1, Rw+2, round( state[_DEFAULT, 1] ), Rr)) ) # right eye		
+
+		# Skip the frame when it would draw exactly what is on screen already: the tweens have
+		# converged. The shapes hold the resolved geometry, flicker offsets included.
+		frame = ( fg_shapes, bg_shapes, self._color_key( self.fgcolor ), self._color_key( self.bgcolor ) )
+		self.settled = frame == self._last_frame
+		if self.settled:
+			self.skipped_frames += 1
+			self.pixels_written = 0
+			# the next frames can be far apart with power saving: restart the tweens with one
+			# frame step when something moves again, not a jump to the targets
+			self.tweenTimer = None
+			return
+		self._last_frame = frame
+
+		written = getattr( self.fb, "pixels_written", 0 )
+		self.draw_shapes( fg_shapes, bg_shapes )
+		self.pixels_written = getattr( self.fb, "pixels_written", 0 ) - written
 		
 		self.on_show( self ) # show drawings on display
 
-	# end of drawEyes method
\ No newline at end of file
+	# end of drawEyes method
+
+	def draw_shapes( self, fg_shapes, bg_shapes ):
+		# Clear the screen, fill the fg shapes in fgcolor then the bg shapes in bgcolor.
+		# Outside the eyes of the previous frame and of this one the screen stays in bgcolor:
+		# when the framebuffer can clip, only those areas are redrawn (and presented).
+		boxes = self._eye_boxes( fg_shapes )
+		areas = self._redraw_areas( boxes )
+		self._last_boxes = boxes
+		if self.display_list and hasattr( self.fb, "begin_record" ):
+			# Record the drawing, then only redraw where it differs from the previous frame's
+			display_list = self.fb.begin_record()
+			try:
+				self._paint( fg_shapes, bg_shapes )
+			finally:
+				self.fb.end_record()
+			display_list = display_list.optimized()
+			damage = display_list.damage( self._last_list )
+			if areas != None:
+				# outside the eyes both frames are bgcolor: a changed eyelid reaching out of
+				# them changes nothing there
+				damage = [ ( max( d[0], a[0] ), max( d[1], a[1] ), min( d[2], a[2] ), min( d[3], a[3] ) )
+					for d in damage for a in areas ]
+				damage = [ d for d in damage if d[0] < d[2] and d[1] < d[3] ]
+			for rect in damage:
+				self.fb.set_clip( *rect )
+				display_list.replay( self.fb, self.gfx, rect )
+			self.fb.set_clip()
+			self._last_list = display_list
+			return
+		self._last_list = None
+		if self.compose and hasattr( self.fb, "compose" ):
+			# The visible eye area is worked out in mask space first and every pixel of the
+			# screen is written once
+			clip = (0, 0, self.screenWidth, self.screenHeight)
+			if self.atlasStale:
+				self.atlasStale = False
+				self.atlas = self.load_atlas( self.atlasDir, build=False ) if self.atlasDir != None else None
+			if self.atlas != None:
+				shape = self.atlas.composite( self.gfx, fg_shapes, bg_shapes, clip )
+			else:
+				shape = composite( [ getattr( self.gfx, kind + "_mask" )( *args ) for kind, args in fg_shapes ],
+					[ getattr( self.gfx, kind + "_mask" )( *args ) for kind, args in bg_shapes ], clip )
+			for area in areas or [ None ]:
+				if area != None:
+					self.fb.set_clip( *area )
+				if shape is None:
+					self.fb.fill( self.bgcolor )
+				else:
+					self.fb.compose( shape[0], shape[1], shape[2], self.fgcolor, self.bgcolor )
+			if areas != None:
+				self.fb.set_clip()
+			return
+		if areas == None:
+			self._paint( fg_shapes, bg_shapes )
+			return
+		for area in areas:
+			self.fb.set_clip( *area )
+			self._paint( fg_shapes, bg_shapes )
+		self.fb.set_clip()
+
+	def _eye_boxes( self, fg_shapes ):
+		# (x0, y0, x1, y1) on screen of each eye, None when not known
+		boxes = []
+		for kind, args in fg_shapes:
+			x, y, w, h = args[:4]
+			if kind != "rrect" or w <= 0 or h <= 0:
+				return None
+			box = ( max( x, 0 ), max( y, 0 ), min( x + w, self.screenWidth ), min( y + h, self.screenHeight ) )
+			if box[0] < box[2] and box[1] < box[3]:
+				boxes.append( box )
+		return boxes
+
+	def _redraw_areas( self, boxes ):
+		# Non overlapping rectangles covering the eyes of the previous frame and the new ones,
+		# None to redraw the whole screen
+		if boxes == None or self._last_boxes == None or not hasattr( self.fb, "set_clip" ):
+			return None
+		areas = []
+		for box in boxes + self._last_boxes:
+			areas += subtract_rects( [ box ], areas )
+		return areas
+
+	def _paint( self, fg_shapes, bg_shapes ):
+		self.fb.fill( self.bgcolor ) # start with a blank screen
+		for kind, args in fg_shapes:
+			getattr( self.gfx, "fill_" + kind )( *args, self.fgcolor )
+		for kind, args in bg_shapes:
+			getattr( self.gfx, "fill_" + kind )( *args, self.bgcolor )
+
+
+for _channel, _names in enumerate( STATE_CHANNELS ):
+	for _plane, _name in enumerate( _names ):
+		if _name != None:
+			setattr( RoboEyes, _name, StateField( _plane, _channel ) )
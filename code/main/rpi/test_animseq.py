@@ -67,5 +67,7 @@ while True:
 		robo.sequences[0].reset()
 		robo.sequences[0].start()
 
-	# Dont' use sleep() or sleep_ms() here in order to ensure fluid eyes animations.
- 	# Check the AnimationSequences example for common practices.
+	# Sleep until the next frame or sequence step is due instead of spinning a CPU core,
+	# a fixed sleep() would make the eyes animation jerky.
+	wait = robo.next_frame_in()
+	time.sleep( (wait if wait != None else 100) / 1000 )
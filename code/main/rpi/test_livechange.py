@@ -15,6 +15,7 @@
 #
 
 from roboeyes import *
+import asyncio
 import time
 from display_fbgen import Framebuffer
 
@@ -78,9 +79,12 @@ robo.curious = True  # bool on/off -> when turned on, height of the outer eyes i
 #robo.laugh() # laughing - eyes shaking up and down
 #robo.wink( right=True ) # make the right Eye Winking
 
-while True:
-	# update eyes drawings
-	robo.update()  
-
-	# Dont' use sleep() or sleep_ms() here in order to ensure fluid eyes animations.
- 	# Check the AnimationSequences example for common practices.
\ No newline at end of file
+# Draw the eyes on the asyncio event loop: each frame at its deadline, sleeping in between.
+# Other tasks run on the same loop, e.g. one awaiting animations:
+#   async def show():
+#   	await robo.blink()
+#   	await robo.laugh()
+#   async def main():
+#   	await asyncio.gather( robo.run(), show() )
+#   asyncio.run( main() )
+asyncio.run( robo.run() )
\ No newline at end of file
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+""" Timelines: keyframed eye animations.
+
+	A timeline animates eye properties along keyframed tracks instead of firing lambdas at
+	fixed times. Each track holds [ ms, value ] keyframes, optionally [ ms, value, mode ]
+	where mode is the interpolation towards the next keyframe (see EASINGS). Timelines are
+	usually loaded from JSON:
+
+	  { "duration": 2000, "loop": false, "resolution": 10, "interpolation": "ease",
+	    "tracks": { "x": [ [0, 100], [1000, 300], [2000, 100] ],
+	                "height": [ [0, 36, "step"], [500, 4], [700, 36] ] } }
+
+	The tracks are compiled at load time into a table holding the values of every track
+	each resolution ms, so a playing timeline costs RoboEyes one row lookup per frame:
+
+	  robo.play_timeline( Timeline.load( "look_around.json" ) )
+
+	The values are targets, like the ones set by the RoboEyes methods: the eyes still
+	move towards them with tweenHalfLife (set it to 0 to follow the keyframes exactly).
+	The eyelid tracks take over from the mood while the timeline plays.
+"""
+import json
+
+import numpy as np
+
+from roboeyes import STATE_CHANNELS
+
+# track name -> the RoboEyes attributes it sets
+TRACKS = {
+	"x": ( "eyeLxNext", ), # left eye, the right one follows it
+	"y": ( "eyeLyNext", ),
+	"width": ( "eyeLwidthNext", "eyeRwidthNext" ),
+	"left_width": ( "eyeLwidthNext", ),
+	"right_width": ( "eyeRwidthNext", ),
+	"height": ( "eyeLheightNext", "eyeRheightNext" ),
+	"left_height": ( "eyeLheightNext", ),
+	"right_height": ( "eyeRheightNext", ),
+	"radius": ( "eyeLborderRadiusNext", "eyeRborderRadiusNext" ),
+	"left_radius": ( "eyeLborderRadiusNext", ),
+	"right_radius": ( "eyeRborderRadiusNext", ),
+	"spacing": ( "spaceBetweenNext", ),
+	"tired": ( "eyelidsTiredHeightNext", ), # eyelid heights
+	"angry": ( "eyelidsAngryHeightNext", ),
+	"happy": ( "eyelidsHappyBottomOffsetNext", ),
+}
+
+# interpolation mode -> eased fraction of a segment, u from 0 to 1
+EASINGS = {
+	"step": lambda u: np.zeros_like( u ), # hold the value until the next keyframe
+	"linear": lambda u: u,
+	"ease": lambda u: u * u * (3 - 2 * u),
+	"ease_in": lambda u: u * u,
+	"ease_out": lambda u: u * (2 - u),
+}
+
+_CHANNEL = { names[1]: channel for channel, names in enumerate( STATE_CHANNELS ) }
+LID_CHANNEL = _CHANNEL["eyelidsTiredHeightNext"] # first eyelid channel, the mood sets them
+
+
+def _sample( keys, times, interpolation ):
+	# values of a track at times, keys being sorted [ ms, value (, mode) ]
+	kt = np.array( [ key[0] for key in keys ], dtype=float )
+	kv = np.array( [ key[1] for key in keys ], dtype=float )
+	i0 = np.clip( np.searchsorted( kt, times, side="right" ) - 1, 0, len( keys ) - 1 )
+	i1 = np.minimum( i0 + 1, len( keys ) - 1 )
+	span = kt[i1] - kt[i0]
+	u = np.clip( (times - kt[i0]) / np.where( span > 0, span, 1 ), 0, 1 )
+	eased = np.zeros_like( u )
+	for i, key in enumerate( keys ):
+		mode = key[2] if len( key ) > 2 else interpolation
+		if mode not in EASINGS:
+			raise ValueError( "unknown interpolation %r" % mode )
+		at = i0 == i
+		eased[at] = EASINGS[mode]( u[at] )
+	return kv[i0] + (kv[i1] - kv[i0]) * eased
+
+
+class Timeline:
+	def __init__( self, tracks, duration=None, loop=False, resolution=10, interpolation="linear", name=None ):
+		""" tracks: { track name: [ [ms, value (, mode)], ... ] }, see TRACKS and EASINGS.
+		    duration defaults to the time of the last keyframe. """
+		for track, keys in tracks.items():
+			if track not in TRACKS:
+				raise ValueError( "unknown track %r" % track )
+			if not keys:
+				raise ValueError( "track %r has no keyframe" % track )
+		self.name = name
+		self.loop = loop
+		self.resolution = max( 1, int( resolution ) ) # ms per table row
+		if duration == None:
+			duration = max( [ key[0] for keys in tracks.values() for key in keys ], default=0 )
+		self.duration = duration
+		columns = sorted( ( _CHANNEL[attr], track ) for track in tracks for attr in TRACKS[track] )
+		if len( set( channel for channel, _track in columns ) ) < len( columns ):
+			raise ValueError( "several tracks set the same attribute" )
+		self.channels = np.array( [ channel for channel, _track in columns ], dtype=int ) # state channel of each column
+		self.lids = int( np.searchsorted( self.channels, LID_CHANNEL ) ) # first eyelid column
+		times = np.arange( self.duration // self.resolution + 1 ) * self.resolution
+		self.table = np.empty( (len( times ), len( columns )) ) # row i: values at i * resolution ms
+		for column, (_channel, track) in enumerate( columns ):
+			keys = sorted( tracks[track], key=lambda key: key[0] )
+			self.table[:, column] = _sample( keys, times, interpolation )
+
+	@classmethod
+	def from_dict( cls, data ):
+		return cls( data["tracks"], data.get( "duration" ), data.get( "loop", False ),
+			data.get( "resolution", 10 ), data.get( "interpolation", "linear" ), data.get( "name" ) )
+
+	@classmethod
+	def loads( cls, text ):
+		return cls.from_dict( json.loads( text ) )
+
+	@classmethod
+	def load( cls, path ):
+		with open( path ) as f:
+			return cls.from_dict( json.load( f ) )
+
+	def row( self, elapsed ):
+		""" Values of the columns elapsed ms after the start, None once a timeline that does
+		    not loop is over. """
+		if elapsed < 0:
+			elapsed = 0
+		if self.loop and self.duration > 0:
+			elapsed %= self.duration
+		elif elapsed > self.duration:
+			return None
+		return self.table[ int( elapsed // self.resolution ) ]
+
+	def __repr__( self ):
+		return "Timeline(%s, %d ms, %d columns, %d rows%s)" % ( self.name, self.duration,
+			len( self.channels ), len( self.table ), ", loop" if self.loop else "" )